@@ -1 +1,5 @@
 from gym.envs.duet.duet_env import DuetGame
+from gym.envs.duet.duet_vec_env import DuetVecEnv
+from gym.envs.duet.duet_subproc_env import DuetSubprocVecEnv
+from gym.envs.duet.duet_recording import EpisodeRecorder, EpisodeReplayer
+from gym.envs.duet.duet_dataset import TrajectoryWriter, TrajectoryDataset
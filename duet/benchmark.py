@@ -0,0 +1,263 @@
+"""
+Throughput benchmark of the Duet environments.
+
+Runs every benchmark case for a fixed number of steps with a fixed action
+sequence and writes steps per second, step latency percentiles and peak
+memory as JSON. Visualized cases render without the delay render()
+normally waits, so that they time the drawing itself. Run it with
+
+    python -m gym.envs.duet.benchmark --output results.json
+
+The SDL dummy video driver is used unless SDL_VIDEODRIVER is already set,
+so no window is opened.
+"""
+
+import argparse
+import fnmatch
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+
+from gym.envs.duet.duet_env import DuetGame
+from gym.envs.duet.duet_vec_env import DuetVecEnv
+from gym.envs.duet.duet_subproc_env import DuetSubprocVecEnv
+
+import contextlib
+with contextlib.redirect_stdout(None):
+    import pygame
+
+PERCENTILES = (50, 90, 99)
+
+
+def default_cases(num_envs=8):
+    """
+    Returns the default benchmark cases as a list of (name, kind, kwargs).
+    kind is "game" for a single DuetGame, "vec" for a DuetVecEnv and "pool"
+    for a DuetSubprocVecEnv, and kwargs are passed to man_init() or to
+    the constructor. Cases of kind "reset" time DuetGame.reset() instead
+    of steps.
+    """
+
+    cases = []
+
+    for state_rep, n_repeat, visualize, random_obstacles in itertools.product(
+            ("pixel", "coord"), (1, 4), (False, True), (True, False)):
+        name = "game-{}-r{}-{}-{}".format(state_rep, n_repeat,
+                                          "vis" if visualize else "novis",
+                                          "random" if random_obstacles else "fixed")
+        kwargs = dict(state_rep=state_rep, n_repeat_action=n_repeat,
+                      visualize=visualize, random_obstacles=random_obstacles)
+        cases.append((name, "game", kwargs))
+
+    cases.append(("game-pixel-numpy-r1", "game", dict(state_rep="pixel", pixel_backend="numpy")))
+
+    for state_rep in ("pixel", "coord"):
+        name = "game-{}-r1-headless".format(state_rep)
+        cases.append((name, "game", dict(state_rep=state_rep, headless=True)))
+
+    for pixel_backend in ("pygame", "numpy"):
+        name = "game-gray-chw-{}-r1".format(pixel_backend)
+        kwargs = dict(state_rep="pixel", pixel_backend=pixel_backend, headless=True,
+                      grayscale=True, channels_first=True)
+        cases.append((name, "game", kwargs))
+
+    for state_rep, random_obstacles in itertools.product(("pixel", "coord"), (True, False)):
+        name = "reset-{}-{}".format(state_rep, "random" if random_obstacles else "fixed")
+        kwargs = dict(state_rep=state_rep, random_obstacles=random_obstacles)
+        cases.append((name, "reset", kwargs))
+
+    for kind, state_rep in itertools.product(("vec", "pool"), ("pixel", "coord")):
+        name = "{}{}-{}".format(kind, num_envs, state_rep)
+        kwargs = dict(num_envs=num_envs, state_rep=state_rep)
+        cases.append((name, kind, kwargs))
+
+    return cases
+
+
+def make_env(kind, kwargs):
+    """
+    Creates the environment of a benchmark case.
+    """
+    if kind in ("game", "reset"):
+        env = DuetGame(headless=kwargs.get("headless", False))
+        env.man_init(**kwargs)
+        env.render_delay = 0
+    elif kind == "vec":
+        env = DuetVecEnv(**kwargs)
+    elif kind == "pool":
+        env = DuetSubprocVecEnv(**kwargs)
+    else:
+        raise ValueError("Invalid benchmark kind '{}'".format(kind))
+    return env
+
+
+def run_steps(env, kind, actions, render=False):
+    """
+    Steps env once for every action in actions, resetting games that end,
+    and returns the duration of every step in nanoseconds. For kind
+    "reset", env is reset once per action instead.
+    """
+
+    clock = time.perf_counter_ns
+    durations = np.empty(len(actions), dtype=np.int64)
+    episodes = 0
+
+    if kind == "reset":
+        for n in range(len(actions)):
+            start = clock()
+            env.reset()
+            durations[n] = clock() - start
+        return durations, len(actions)
+
+    for n, action in enumerate(actions):
+        start = clock()
+        if kind == "game":
+            _, _, game_over, _ = env.step(action)
+            if render:
+                env.render()
+        else:
+            _, _, game_overs = env.step(action)
+        durations[n] = clock() - start
+
+        if kind == "game":
+            if game_over:
+                env.reset()
+                episodes += 1
+        else:
+            episodes += int(game_overs.sum())
+
+    return durations, episodes
+
+
+def run_case(name, kind, kwargs, n_steps=2000, n_warmup=200, n_memory_steps=500, seed=0):
+    """
+    Runs one benchmark case and returns its results as a dict.
+
+    Steps are first timed without tracing memory, then peak memory is
+    measured with tracemalloc over n_memory_steps further steps. For pools
+    only the memory of the main process is traced.
+    """
+
+    env = make_env(kind, kwargs)
+    num_envs = kwargs.get("num_envs", 1)
+    render = kind == "game" and kwargs.get("visualize", False)
+
+    rng = np.random.RandomState(seed)
+    size = n_warmup + n_steps + n_memory_steps
+    if kind in ("game", "reset"):
+        actions = rng.randint(0, 3, size=size).tolist()
+    else:
+        actions = rng.randint(0, 3, size=(size, num_envs))
+
+    try:
+        env.seed(seed)
+        env.reset()
+
+        run_steps(env, kind, actions[:n_warmup], render)
+
+        start = time.perf_counter()
+        durations, episodes = run_steps(env, kind, actions[n_warmup:n_warmup + n_steps], render)
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        run_steps(env, kind, actions[n_warmup + n_steps:], render)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        if kind == "pool":
+            env.close()
+
+    latencies = np.percentile(durations, PERCENTILES)/1e3
+
+    return {
+        "name": name,
+        "kind": kind,
+        "config": kwargs,
+        "steps": n_steps,
+        "episodes": episodes,
+        "seconds": elapsed,
+        "steps_per_sec": n_steps/elapsed,
+        "env_steps_per_sec": n_steps*num_envs/elapsed,
+        "latency_us": {"p{}".format(p): float(latency)
+                       for p, latency in zip(PERCENTILES, latencies)},
+        "latency_us_mean": float(durations.mean()/1e3),
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def environment_info():
+    """
+    Returns the versions of the software the benchmark ran with.
+    """
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pygame": pygame.version.ver,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "video_driver": os.environ.get("SDL_VIDEODRIVER"),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Benchmark the Duet environments.")
+    parser.add_argument("--steps", type=int, default=2000,
+                        help="number of timed steps per case")
+    parser.add_argument("--warmup", type=int, default=200,
+                        help="number of untimed steps before timing")
+    parser.add_argument("--memory-steps", type=int, default=500,
+                        help="number of steps traced for peak memory")
+    parser.add_argument("--num-envs", type=int, default=8,
+                        help="number of games in the vec and pool cases")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cases", nargs="*", default=["*"],
+                        help="glob patterns of the case names to run")
+    parser.add_argument("--list", action="store_true",
+                        help="list the case names and exit")
+    parser.add_argument("--output", default=None,
+                        help="file to write the JSON results to, default stdout")
+    args = parser.parse_args(argv)
+
+    cases = [case for case in default_cases(args.num_envs)
+             if any(fnmatch.fnmatch(case[0], pattern) for pattern in args.cases)]
+
+    if args.list:
+        for name, _, _ in cases:
+            print(name)
+        return
+
+    results = []
+    for name, kind, kwargs in cases:
+        result = run_case(name, kind, kwargs, args.steps, args.warmup,
+                          args.memory_steps, args.seed)
+        results.append(result)
+        print("{:<32} {:>10.0f} steps/s  p50 {:>8.1f} us  p99 {:>8.1f} us  peak {:>8.1f} KiB".format(
+            name, result["env_steps_per_sec"], result["latency_us"]["p50"],
+            result["latency_us"]["p99"], result["peak_memory_bytes"]/1024), file=sys.stderr)
+
+    report = {"environment": environment_info(),
+              "settings": {"steps": args.steps, "warmup": args.warmup,
+                           "memory_steps": args.memory_steps, "seed": args.seed,
+                           "render_delay_ms": 0},
+              "results": results}
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
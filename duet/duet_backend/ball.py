@@ -4,30 +4,76 @@ import contextlib
 with contextlib.redirect_stdout(None):
     import pygame
 
+from gym.envs.duet.duet_backend.collision import get_collision_function
+
 BALL_RADIUS = 15   # size of player balls
 
+_SPIN_OFFSETS = {}
+
+
+def n_spin_angles(vel):
+    """
+    Returns the number of angles a ball spinning with angular step vel
+    can be at, with the step rounded so that a full turn is a whole
+    number of steps.
+    """
+    return int(round(2*np.pi/vel))
+
+
+def spin_offsets(r, n_angles):
+    """
+    Returns the x and y offsets from the center of the circle of a ball
+    at each of n_angles evenly spaced angles, as two numpy int arrays.
+    The tables are computed once and cached.
+    """
+    key = (r, n_angles)
+    if key not in _SPIN_OFFSETS:
+        theta = 2*np.pi*np.arange(n_angles)/n_angles
+        _SPIN_OFFSETS[key] = (np.trunc(r*np.cos(theta)).astype(np.int64),
+                              np.trunc(r*np.sin(theta)).astype(np.int64))
+    return _SPIN_OFFSETS[key]
+
 
 class Ball(object):
     """
     Player ball in the Duet game.
     """
 
-    def __init__(self, x, y, theta, r, vel, draw_rects):
+    def __init__(self, x, y, theta, r, vel, draw_rects, collision="box"):
         """
         Creates a player ball with specified position and velocity.
+
+        collision selects how collisions with obstacles are detected,
+        "box" for the bounding box of the ball or "circle" for the ball
+        itself.
         """
 
         self.x = x
         self.y = y
-        self.theta = theta
 
-        self.xc = (self.x - r) if self.theta == 0 else (self.x + r)
+        self.xc = (self.x - r) if theta == 0 else (self.x + r)
         self.yc = y
 
         self.ang_vel = vel
         self.radius = r
 
+        # The angle is kept as an index into precomputed position offsets
+        self.n_angles = n_spin_angles(vel)
+        self.angle = int(round(theta*self.n_angles/(2*np.pi))) % self.n_angles
+        x_offsets, y_offsets = spin_offsets(r, self.n_angles)
+        self.x_offsets = x_offsets.tolist()
+        self.y_offsets = y_offsets.tolist()
+
+        self.start_angle = self.angle
+
         self.draw_rects = draw_rects
+        self.collides = get_collision_function(collision)
+
+    def reset(self):
+        """
+        Places the ball back at the angle it was created at.
+        """
+        self.set_angle(self.start_angle)
 
     def position(self):
         """
@@ -35,37 +81,64 @@ class Ball(object):
         """
         return (self.x, self.y)
 
+    @property
+    def theta(self):
+        """
+        Returns the current angle of the ball in radians.
+        """
+        return 2*np.pi*self.angle/self.n_angles
+
+    def set_angle(self, angle):
+        """
+        Places the ball at the given angle index.
+        """
+        self.angle = angle % self.n_angles
+        self.x = self.xc + self.x_offsets[self.angle]
+        self.y = self.yc + self.y_offsets[self.angle]
+
     def spin_left(self):
         """
         Spins the ball counter-clockwise.
         """
-        self.theta -= self.ang_vel
-        self.theta = self.theta % (2*np.pi)
-        self.theta = max(2*np.pi + self.theta, self.theta)
-        self.x = self.xc + int(self.radius*np.cos(self.theta))
-        self.y = self.yc + int(self.radius*np.sin(self.theta))
+        self.angle = (self.angle - 1) % self.n_angles
+        self.x = self.xc + self.x_offsets[self.angle]
+        self.y = self.yc + self.y_offsets[self.angle]
 
     def spin_right(self):
         """
         Spins the ball clockwise.
         """
-        self.theta += self.ang_vel
-        self.theta = self.theta % (2*np.pi)
-        self.theta = max(2*np.pi + self.theta, self.theta)
-        self.x = self.xc + int(self.radius*np.cos(self.theta))
-        self.y = self.yc + int(self.radius*np.sin(self.theta))
+        self.angle = (self.angle + 1) % self.n_angles
+        self.x = self.xc + self.x_offsets[self.angle]
+        self.y = self.yc + self.y_offsets[self.angle]
 
     def collided_with(self, obstacle):
         """
         Checks if the ball has collided with obstacle.
         """
-        return self.rect.colliderect(obstacle.get_rect())
+        return self.collided_with_rect(obstacle.left, obstacle.right,
+                                       obstacle.top, obstacle.top + obstacle.height)
+
+    def collided_with_rect(self, left, right, top, bottom):
+        """
+        Checks if the ball has collided with the rectangle spanning
+        [left, right) x [top, bottom).
+        """
+        return self.collides(self.x, self.y, BALL_RADIUS, left, right, top, bottom)
+
+    def get_rect(self):
+        """
+        Returns the bounding box of the ball as a pygame Rect, i.e. the
+        same Rect that pygame.draw.circle returns when drawing the ball.
+        """
+        return pygame.Rect(self.x - BALL_RADIUS, self.y - BALL_RADIUS,
+                           2*BALL_RADIUS, 2*BALL_RADIUS)
 
     def draw(self, screen, color):
         """
-        Draws the ball.
+        Draws the ball and returns the Rect of the pixels it covers.
         """
-        self.rect = pygame.draw.circle(screen, color,
-                                       self.position(), BALL_RADIUS)
+        rect = pygame.draw.circle(screen, color, self.position(), BALL_RADIUS)
         if self.draw_rects:
-            pygame.draw.rect(screen, color, self.rect)
+            rect = rect.union(pygame.draw.rect(screen, color, self.get_rect()))
+        return rect
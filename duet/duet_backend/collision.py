@@ -0,0 +1,64 @@
+import numpy as np
+
+
+def box_collision(x, y, radius, left, right, top, bottom):
+    """
+    Checks if the bounding box of a ball centered at (x, y) overlaps the
+    rectangle spanning [left, right) x [top, bottom).
+
+    Gives exactly the same result as pygame.Rect.colliderect on the Rect
+    returned by pygame.draw.circle when drawing the ball.
+    """
+    return (x - radius < right and left < x + radius and
+            y - radius < bottom and top < y + radius)
+
+
+def circle_collision(x, y, radius, left, right, top, bottom):
+    """
+    Checks if a ball centered at (x, y) overlaps the rectangle spanning
+    [left, right) x [top, bottom), using the distance from the center of
+    the ball to the closest point of the rectangle.
+    """
+    dx = x - min(max(x, left), right)
+    dy = y - min(max(y, top), bottom)
+    return dx*dx + dy*dy < radius*radius
+
+
+def box_collision_array(x, y, radius, left, right, top, bottom):
+    """
+    Elementwise version of box_collision for numpy arrays.
+    """
+    return ((x - radius < right) & (left < x + radius) &
+            (y - radius < bottom) & (top < y + radius))
+
+
+def circle_collision_array(x, y, radius, left, right, top, bottom):
+    """
+    Elementwise version of circle_collision for numpy arrays.
+    """
+    dx = x - np.minimum(np.maximum(x, left), right)
+    dy = y - np.minimum(np.maximum(y, top), bottom)
+    return dx*dx + dy*dy < radius*radius
+
+
+COLLISION_MODES = {
+    "box": box_collision,
+    "circle": circle_collision,
+}
+
+COLLISION_ARRAY_MODES = {
+    "box": box_collision_array,
+    "circle": circle_collision_array,
+}
+
+
+def get_collision_function(collision, vectorized=False):
+    """
+    Returns the collision function for the given collision mode, or its
+    elementwise numpy version if vectorized is True.
+    """
+    modes = COLLISION_ARRAY_MODES if vectorized else COLLISION_MODES
+    try:
+        return modes[collision]
+    except KeyError:
+        raise ValueError("Invalid collision mode '{}'".format(collision))
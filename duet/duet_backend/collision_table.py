@@ -0,0 +1,177 @@
+import os
+
+import numpy as np
+
+from gym.envs.duet.duet_backend.ball import BALL_RADIUS, spin_offsets
+from gym.envs.duet.duet_backend.collision import get_collision_function
+from gym.envs.duet.duet_backend.obstacle_manager import (BOARD_WIDTH, ObstacleType,
+                                                         OBS_TYPE_COORDS, MAX_SET_SIZE)
+
+_TABLES = {}
+
+
+class CollisionTable(object):
+    """
+    Precomputed collisions between a ball and an obstacle set.
+
+    The ball can only be at n_angles positions on the circle, and every
+    obstacle type has a fixed shape, so whether a ball hits an obstacle set
+    only depends on the angle index of the ball, the type of the set and
+    the y-coordinate of its top. self.bits[angle, obs_type, top - top_min]
+    holds a bitmask with bit k set if the ball hits obstacle k of the set.
+    """
+
+    def __init__(self, bits, top_min, templates, params):
+
+        self.bits = bits
+        self.top_min = top_min
+        self.n_tops = bits.shape[2]
+
+        # (count, lefts, width, height) of each obstacle type, see
+        # obstacle_templates()
+        self.templates = templates
+
+        # (collision, n_angles, center, r) the table was built for
+        self.params = params
+
+    @classmethod
+    def build(cls, collision, n_angles, center, r):
+        """
+        Builds the table for collision mode collision, with the ball at
+        n_angles angles on a circle of radius r around center.
+        """
+
+        templates = obstacle_templates()
+        collides = get_collision_function(collision, vectorized=True)
+
+        x_offsets, y_offsets = spin_offsets(r, n_angles)
+        ball_x = (center[0] + x_offsets)[:, None]
+        ball_y = (center[1] + y_offsets)[:, None]
+
+        # Tops of obstacle sets that can hit the ball at some angle
+        max_height = templates[:, -1].max()
+        top_min = int(ball_y.min()) - BALL_RADIUS - max_height
+        top_max = int(ball_y.max()) + BALL_RADIUS
+        tops = np.arange(top_min, top_max + 1)[None, :]
+
+        bits = np.zeros((n_angles, len(templates), len(tops[0])), dtype=np.uint8)
+        for obs_type, row in enumerate(templates):
+            count, lefts, width, height = row[0], row[1:-2], row[-2], row[-1]
+            for k in range(count):
+                left = lefts[k]
+                hit = collides(ball_x, ball_y, BALL_RADIUS,
+                               left, left + width, tops, tops + height)
+                bits[:, obs_type] |= (hit << k).astype(np.uint8)
+
+        return cls(bits, top_min, templates, (collision, n_angles, tuple(center), r))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a table saved with save().
+        """
+        with np.load(path) as data:
+            params = (str(data["collision"]), int(data["n_angles"]),
+                      tuple(data["center"].tolist()), int(data["r"]))
+            return cls(data["bits"], int(data["top_min"]), data["templates"], params)
+
+    def save(self, path):
+        """
+        Saves the table to path as a .npz file.
+        """
+        collision, n_angles, center, r = self.params
+        np.savez(path, bits=self.bits, top_min=self.top_min, templates=self.templates,
+                 collision=collision, n_angles=n_angles, center=center, r=r)
+
+    def lookup(self, angle, obs_type, top):
+        """
+        Returns the bitmask of the obstacles of a set of type obs_type
+        (an ObstacleType value) with its top at top, that a ball at angle
+        index angle hits. Works elementwise on numpy arrays.
+        """
+        index = top - self.top_min
+        inside = (index >= 0) & (index < self.n_tops)
+        bits = self.bits[angle, obs_type, np.clip(index, 0, self.n_tops - 1)]
+        return np.where(inside, bits, 0)
+
+    def collided(self, angles, obs_type, top):
+        """
+        Checks if any of the balls at the angle indices in angles hits an
+        obstacle set of type obs_type with its top at top.
+        """
+        index = top - self.top_min
+        if index < 0 or index >= self.n_tops:
+            return False
+        for angle in angles:
+            if self.bits[angle, obs_type, index]:
+                return True
+        return False
+
+    def matches(self, tape):
+        """
+        Checks that every obstacle set on tape, an ObstacleTape, has the
+        shape of its type that the table was built for.
+        """
+        templates = self.templates[tape.obs_type]
+        count, lefts, width, height = (templates[:, 0], templates[:, 1:1 + MAX_SET_SIZE],
+                                       templates[:, -2], templates[:, -1])
+        present = np.arange(MAX_SET_SIZE) < count[:, None]
+        return bool(np.all(count == tape.count) and np.all(width == tape.width) and
+                    np.all(height == tape.height) and
+                    np.all((lefts == tape.left) | ~present))
+
+
+def obstacle_templates():
+    """
+    Returns the fixed shape of every obstacle type as an array with one row
+    (count, left_1, ..., left_MAX_SET_SIZE, width, height) per ObstacleType
+    value. Raises ValueError if the obstacle types are not of fixed shape.
+    """
+
+    templates = np.zeros((len(ObstacleType) + 1, MAX_SET_SIZE + 3), dtype=np.int64)
+    for obs_type, coords in OBS_TYPE_COORDS.items():
+        (min_left, max_left, min_right, max_right,
+         min_height, max_height) = coords
+        if min_left != max_left or min_right != max_right or min_height != max_height:
+            raise ValueError("Obstacle type {} is not of fixed shape".format(obs_type))
+
+        width = min_right - min_left
+        lefts = [min_left]
+        if obs_type == ObstacleType.DOUBLE:
+            lefts.append(BOARD_WIDTH - min_left - width)
+
+        row = templates[obs_type.value]
+        row[0] = len(lefts)
+        row[1:1 + len(lefts)] = lefts
+        row[-2] = width
+        row[-1] = min_height
+
+    return templates
+
+
+def get_collision_table(collision, n_angles, center, r, cache_path=None):
+    """
+    Returns the collision table for the given collision mode and ball
+    geometry. Tables are built once per process, and if cache_path is given
+    loaded from that file, or built and saved to it if the file is missing
+    or holds a table for other parameters.
+    """
+
+    key = (collision, n_angles, tuple(center), r)
+    if key in _TABLES:
+        return _TABLES[key]
+
+    table = None
+    if cache_path is not None and os.path.exists(cache_path):
+        table = CollisionTable.load(cache_path)
+        if table.params != key or not np.array_equal(table.templates, obstacle_templates()):
+            table = None
+
+    if table is None:
+        table = CollisionTable.build(collision, n_angles, center, r)
+        if cache_path is not None:
+            table.save(cache_path)
+
+    _TABLES[key] = table
+
+    return table
@@ -0,0 +1,123 @@
+import numpy as np
+
+
+class FrameStack(object):
+    """
+    Ring buffer of the last n_frames states, stacked along their channel
+    axis.
+
+    The buffer holds 2*n_frames slots along a time axis placed right
+    before the channel axis of a state, and every state is written to two
+    slots n_frames apart. The last n_frames states are then always a
+    contiguous window of the buffer, so the stacked state is a view of the
+    buffer that is never copied. Stacking (84, 84, 1) states 4 deep gives
+    (84, 84, 4) stacked states, and (1, 84, 84) states give (4, 84, 84).
+
+    Each state is stored only once, apart from its twin slot, so replay
+    buffers can keep the single newest state, latest(), of every step
+    together with frame_index and rebuild stacks from indices instead of
+    storing whole stacks.
+
+    States can be batched along a leading batch axis by giving batch_shape,
+    e.g. (num_envs,).
+    """
+
+    def __init__(self, n_frames, state_shape, dtype, channel_axis=-1, batch_shape=()):
+
+        if n_frames < 1:
+            raise ValueError("Invalid number of frames {}".format(n_frames))
+
+        self.n_frames = n_frames
+        self.state_shape = tuple(state_shape)
+        self.batch_shape = tuple(batch_shape)
+
+        channel_axis %= len(self.state_shape)
+        stacked_shape = list(self.state_shape)
+        stacked_shape[channel_axis] *= n_frames
+        self.stacked_shape = self.batch_shape + tuple(stacked_shape)
+
+        # Time axis of the buffer, right before the channel axis
+        self.time_axis = len(self.batch_shape) + channel_axis
+        buffer_shape = list(self.batch_shape + self.state_shape)
+        buffer_shape.insert(self.time_axis, 2*n_frames)
+        self.buffer = np.zeros(buffer_shape, dtype=dtype)
+
+        self.slots = [self.buffer[self._time_index(slot)] for slot in range(2*n_frames)]
+        self.views = []
+        for newest in range(n_frames):
+            window = self.buffer[self._time_index(slice(newest + 1, newest + 1 + n_frames))]
+            view = window.reshape(self.stacked_shape)
+            if not np.shares_memory(view, self.buffer):
+                raise RuntimeError("Stacked states are not a view of the buffer")
+            self.views.append(view)
+
+        # Number of states pushed so far, the index of the next state
+        self.frame_index = 0
+
+    def next_frame(self):
+        """
+        Returns the slot the next state is written to, which is pushed by
+        advance().
+        """
+        return self.slots[self.frame_index % self.n_frames]
+
+    def advance(self, new_episode=None):
+        """
+        Pushes the state written to next_frame(). Where new_episode is True,
+        for a single state or the batch entries selected by the boolean
+        array new_episode, the whole stack is filled with that state, as at
+        the start of an episode.
+        """
+
+        slot = self.frame_index % self.n_frames
+        frame = self.slots[slot]
+        np.copyto(self.slots[slot + self.n_frames], frame)
+
+        if new_episode is not None and np.any(new_episode):
+            if self.batch_shape:
+                self.buffer[new_episode] = np.expand_dims(frame[new_episode], self.time_axis)
+            else:
+                self.buffer[...] = np.expand_dims(frame, self.time_axis)
+
+        self.frame_index += 1
+
+    def stacked(self):
+        """
+        Returns the stacked last n_frames states, oldest first, as a view of
+        the buffer that is overwritten by the next states.
+        """
+        return self.views[(self.frame_index - 1) % self.n_frames]
+
+    def latest(self):
+        """
+        Returns the newest state, with index frame_index - 1.
+        """
+        return self.slots[(self.frame_index - 1) % self.n_frames]
+
+    def frames(self, out=None):
+        """
+        Returns the last n_frames states, oldest first, along an axis placed
+        after the batch axes, written to out if given.
+        """
+        newest = (self.frame_index - 1) % self.n_frames
+        window = self.buffer[self._time_index(slice(newest + 1, newest + 1 + self.n_frames))]
+        window = np.moveaxis(window, self.time_axis, len(self.batch_shape))
+        if out is None:
+            return window.copy()
+        np.copyto(out, window)
+        return out
+
+    def fill(self, frames):
+        """
+        Pushes frames, n_frames states oldest first as returned by frames(),
+        so that they make up the stacked state.
+        """
+        for frame in np.moveaxis(frames, len(self.batch_shape), 0):
+            np.copyto(self.next_frame(), frame)
+            self.advance()
+
+    def _time_index(self, index):
+        """
+        Returns the index tuple selecting index along the time axis.
+        """
+        return (slice(None),)*self.time_axis + (index,)
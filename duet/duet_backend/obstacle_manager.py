@@ -1,6 +1,8 @@
 import random
 from enum import Enum
 
+import numpy as np
+
 import contextlib
 with contextlib.redirect_stdout(None):
     import pygame
@@ -13,6 +15,28 @@ OBS_VEL = 2
 
 SPAWN_HEIGHT = 0
 
+TAPE_CHUNK = 16  # obstacle sets generated at a time
+
+# An obstacle set leaves the board roughly 520 frames after it spawned,
+# so at most four sets are on the board at once.
+MAX_OBSTACLE_SETS = 5
+MAX_SET_SIZE = 2
+
+# Record holding the full state of an ObstacleManager, see get_state()
+OBSTACLE_STATE_DTYPE = np.dtype([
+    ("t", np.int64),
+    ("head", np.int64),
+    ("size", np.int64),
+    ("cursor", np.int64),
+    ("obs_type", np.int8, (MAX_OBSTACLE_SETS,)),
+    ("count", np.int32, (MAX_OBSTACLE_SETS,)),
+    ("spawn_y", np.int32, (MAX_OBSTACLE_SETS,)),
+    ("spawn_t", np.int64, (MAX_OBSTACLE_SETS,)),
+    ("height", np.int32, (MAX_OBSTACLE_SETS,)),
+    ("left", np.int32, (MAX_OBSTACLE_SETS, MAX_SET_SIZE)),
+    ("right", np.int32, (MAX_OBSTACLE_SETS, MAX_SET_SIZE)),
+])
+
 # Types of obstacles
 # (min_left, max_left, min_right, max_right, min_height, max_height)
 # MID_COORDS = (195, 235, 308, 345, 70, 70)
@@ -25,82 +49,217 @@ DOUBLE_COORDS = (30, 30, 190, 190, 70, 70)  # left coords
 class ObstacleManager(object):
     """
     Generates and manages obstacles for the Duet game.
+
+    The obstacle sets on the board are kept in a fixed size ring buffer of
+    numpy arrays, with one row per set and the oldest set at self.head.
+    Obstacle objects are views of this storage, kept for compatibility.
+
+    Obstacles fall at the constant speed OBS_VEL, so only the frame each
+    set spawned at is stored and positions are computed when asked for.
+    Moving the obstacles just advances the frame counter self.t.
+
+    New obstacle sets are read from an ObstacleTape. If tape is given it is
+    used as is, and read from the start again when it runs out. Otherwise
+    the tape is generated TAPE_CHUNK sets at a time from the seeded
+    obstacle generator.
     """
 
-    def __init__(self, random_obstacles):
+    def __init__(self, random_obstacles, seed=None, tape=None):
 
+        self.random_obstacles = random_obstacles
         if not random_obstacles:
-            random.seed(221)  # for deterministic sequence
+            seed = 221  # for deterministic sequence
+        self.rng = random.Random(seed)
+
+        self.fixed_tape = tape is not None
+        self.tape = tape if self.fixed_tape else ObstacleTape.generate(self.rng, TAPE_CHUNK)
+        self.cursor = 0
 
-        self.obstacles = []
+        self.obs_type = np.zeros(MAX_OBSTACLE_SETS, dtype=np.int8)
+        self.count = np.zeros(MAX_OBSTACLE_SETS, dtype=np.int64)
+        self.spawn_y = np.zeros(MAX_OBSTACLE_SETS, dtype=np.int64)
+        self.spawn_t = np.zeros(MAX_OBSTACLE_SETS, dtype=np.int64)
+        self.height = np.zeros(MAX_OBSTACLE_SETS, dtype=np.int64)
+        self.left = np.zeros((MAX_OBSTACLE_SETS, MAX_SET_SIZE), dtype=np.int64)
+        self.right = np.zeros((MAX_OBSTACLE_SETS, MAX_SET_SIZE), dtype=np.int64)
+
+        self.head = 0
+        self.size = 0
+        self.t = 0
+
+        self.views = [[Obstacle(self, slot, k) for k in range(MAX_SET_SIZE)]
+                      for slot in range(MAX_OBSTACLE_SETS)]
 
     def __iter__(self):
 
-        return iter(self.obstacles)
+        return iter(self.get_obstacles())
 
-    def new_obstacle_set(self):
-        """
-        Generates a new obstacle set.
+    def reset(self, seed=None):
         """
+        Empties the board for a new episode, with the obstacle generator
+        reseeded from seed, reusing the storage of the manager.
 
-        obs_type = self.random_obstacle_type()
+        Without random obstacles the generated tape is the same every
+        episode, so it is kept and read from the start again.
+        """
 
-        if obs_type == ObstacleType.MID:
-            COORDS = MID_COORDS
-        elif obs_type == ObstacleType.LEFT:
-            COORDS = LEFT_COORDS
-        elif obs_type == ObstacleType.RIGHT:
-            COORDS = RIGHT_COORDS
-        elif obs_type == ObstacleType.DOUBLE:
-            COORDS = DOUBLE_COORDS
+        if not self.fixed_tape and self.random_obstacles:
+            self.rng.seed(seed)
+            self.tape.refill(self.rng, TAPE_CHUNK)
+        self.cursor = 0
 
-        (min_left, max_left, min_right, max_right,
-         min_height, max_height) = COORDS
+        self.obs_type.fill(0)
+        self.count.fill(0)
+        self.spawn_y.fill(0)
+        self.spawn_t.fill(0)
+        self.height.fill(0)
+        self.left.fill(0)
+        self.right.fill(0)
 
-        spawn_x = random.randint(min_left, max_left)
-        width = random.randint(min_right, max_right) - spawn_x
-        height = random.randint(min_height, max_height)
-        spawn_y = SPAWN_HEIGHT - height
+        self.head = 0
+        self.size = 0
+        self.t = 0
 
-        new_obstacle_set = [Obstacle(spawn_x, spawn_y, width, height, obs_type)]
+    def new_obstacle_set(self):
+        """
+        Generates a new obstacle set.
+        """
 
-        if obs_type == ObstacleType.DOUBLE:
-            spawn_x = BOARD_WIDTH - random.randint(min_left, max_left) - width
-            new_obstacle_set.append(Obstacle(spawn_x, spawn_y, width, height, obs_type))
+        if self.size == MAX_OBSTACLE_SETS:
+            raise RuntimeError("Too many obstacle sets on the board")
+
+        if self.fixed_tape:
+            row = self.cursor % len(self.tape)
+        else:
+            if self.cursor == len(self.tape):
+                self.tape.extend(self.rng, TAPE_CHUNK)
+            row = self.cursor
+        self.cursor += 1
+
+        tape = self.tape
+        slot = (self.head + self.size) % MAX_OBSTACLE_SETS
+        self.obs_type[slot] = tape.obs_type[row]
+        self.count[slot] = tape.count[row]
+        self.spawn_y[slot] = SPAWN_HEIGHT - tape.height[row]
+        self.spawn_t[slot] = self.t
+        self.height[slot] = tape.height[row]
+        self.left[slot] = tape.left[row]
+        self.right[slot] = tape.left[row] + tape.width[row]
+
+        self.size += 1
+
+    def move_obstacles(self, n_steps=1):
+        """
+        Moves all obstacles n_steps steps down, towards the player.
+        """
+        self.t += n_steps
 
-        self.obstacles.append(new_obstacle_set)
+    def set_top(self, slot):
+        """
+        Returns the y-coordinate of the top of the obstacle set stored at slot.
+        """
+        return int(self.spawn_y[slot]) + OBS_VEL*(self.t - int(self.spawn_t[slot]))
 
-    def random_obstacle_type(self):
+    def obstacle_set(self, n):
         """
-        Picks a random obstacle type.
+        Returns the n:th oldest obstacle set as a list of Obstacle views.
         """
-        return random.choice(list(ObstacleType))
-        # return random.choice([ObstacleType.DOUBLE, ObstacleType.LEFT, ObstacleType.RIGHT])
+        slot = (self.head + n) % MAX_OBSTACLE_SETS
+        return self.views[slot][:self.count[slot]]
 
     def get_obstacles(self):
         """
         Returns the list of obstacle sets.
         """
-        return self.obstacles
+        return [self.obstacle_set(n) for n in range(self.size)]
 
     def oldest_obstacle_set(self):
         """
         Returns the oldest obstacle set.
         """
-        return self.obstacles[0]
+        return self.obstacle_set(0)
+
+    def oldest_rects(self):
+        """
+        Returns the (left, right, top, bottom) edges of every obstacle in the
+        oldest obstacle set, with bottom being the lower edge on the screen.
+        """
+        return self._set_rects(self.head)
+
+    def rects(self):
+        """
+        Returns the (left, right, top, bottom) edges of every obstacle on the
+        board, with bottom being the lower edge on the screen.
+        """
+        rects = []
+        for n in range(self.size):
+            rects += self._set_rects((self.head + n) % MAX_OBSTACLE_SETS)
+        return rects
+
+    def get_state(self, record):
+        """
+        Writes the state of the manager to record, a numpy record of dtype
+        OBSTACLE_STATE_DTYPE.
+        """
+        record["t"] = self.t
+        record["head"] = self.head
+        record["size"] = self.size
+        record["cursor"] = self.cursor
+        record["obs_type"] = self.obs_type
+        record["count"] = self.count
+        record["spawn_y"] = self.spawn_y
+        record["spawn_t"] = self.spawn_t
+        record["height"] = self.height
+        record["left"] = self.left
+        record["right"] = self.right
+
+    def set_state(self, record):
+        """
+        Restores the state of the manager from a record written by
+        get_state(), for the same tape.
+        """
+        self.t = int(record["t"])
+        self.head = int(record["head"])
+        self.size = int(record["size"])
+        self.cursor = int(record["cursor"])
+        self.obs_type[:] = record["obs_type"]
+        self.count[:] = record["count"]
+        self.spawn_y[:] = record["spawn_y"]
+        self.spawn_t[:] = record["spawn_t"]
+        self.height[:] = record["height"]
+        self.left[:] = record["left"]
+        self.right[:] = record["right"]
+
+        # The generated tape is deterministic, so it can be extended to
+        # any cursor reached from the same seed
+        if not self.fixed_tape:
+            while len(self.tape) < self.cursor:
+                self.tape.extend(self.rng, TAPE_CHUNK)
 
     def oldest_out_of_frame(self):
         """
         Checks if the oldest obstacle set has gone out of frame.
         """
 
-        return self.obstacles[0][0].out_of_frame()
+        return self.set_top(self.head) - 5 >= BOARD_HEIGHT
 
     def remove_obstacle_set(self):
         """
         Removes the oldest obstacle set.
         """
-        self.obstacles.pop(0)
+        self.head = (self.head + 1) % MAX_OBSTACLE_SETS
+        self.size -= 1
+
+    def _set_rects(self, slot):
+        """
+        Returns the (left, right, top, bottom) edges of every obstacle in the
+        obstacle set stored at slot.
+        """
+        count = self.count[slot]
+        top = self.set_top(slot)
+        bottom = top + int(self.height[slot])
+        return [(left, right, top, bottom) for left, right in
+                zip(self.left[slot, :count].tolist(), self.right[slot, :count].tolist())]
 
 
 class ObstacleType(Enum):
@@ -113,32 +272,193 @@ class ObstacleType(Enum):
     DOUBLE = 4
 
 
-class Obstacle(object):
+OBSTACLE_TYPES = tuple(ObstacleType)
+
+OBS_TYPE_COORDS = {
+    ObstacleType.MID: MID_COORDS,
+    ObstacleType.LEFT: LEFT_COORDS,
+    ObstacleType.RIGHT: RIGHT_COORDS,
+    ObstacleType.DOUBLE: DOUBLE_COORDS,
+}
+
+
+def episode_seed(seed, index, episode):
+    """
+    Derives the seed of the obstacle generator for episode number episode
+    of the env with index index, from the seed shared by all envs. Every
+    (index, episode) pair gets an independent stream.
+    """
+    seed_sequence = np.random.SeedSequence(seed, spawn_key=(index, episode))
+    return int(seed_sequence.generate_state(1, dtype=np.uint64)[0])
+
+
+def generate_obstacle_set(rng):
+    """
+    Draws a new obstacle set from rng, a random.Random instance.
+
+    Returns (obs_type, spawn_xs, width, height), where spawn_xs holds the
+    left x-coordinate of each obstacle in the set.
     """
-    An obstacle in the Duet game.
+
+    obs_type = rng.choice(OBSTACLE_TYPES)
+    # obs_type = rng.choice([ObstacleType.DOUBLE, ObstacleType.LEFT, ObstacleType.RIGHT])
+
+    (min_left, max_left, min_right, max_right,
+     min_height, max_height) = OBS_TYPE_COORDS[obs_type]
+
+    spawn_x = rng.randint(min_left, max_left)
+    width = rng.randint(min_right, max_right) - spawn_x
+    height = rng.randint(min_height, max_height)
+
+    spawn_xs = [spawn_x]
+    if obs_type == ObstacleType.DOUBLE:
+        spawn_xs.append(BOARD_WIDTH - rng.randint(min_left, max_left) - width)
+
+    return obs_type, spawn_xs, width, height
+
+
+class ObstacleTape(object):
     """
+    A precompiled schedule of obstacle sets, stored as numpy arrays with one
+    row per set holding its type, number of obstacles, the left x-coordinate
+    of each obstacle, and the width and height of the obstacles.
+
+    A tape can be shared by several games, for instance to evaluate agents
+    on the same obstacles, and saved to and loaded from disk.
+    """
+
+    def __init__(self, obs_type, count, left, width, height):
 
-    def __init__(self, x, y, width, height, obs_type):
+        self.obs_type = np.asarray(obs_type, dtype=np.int8)
+        self.count = np.asarray(count, dtype=np.int64)
+        self.left = np.asarray(left, dtype=np.int64).reshape(-1, MAX_SET_SIZE)
+        self.width = np.asarray(width, dtype=np.int64)
+        self.height = np.asarray(height, dtype=np.int64)
 
-        self.x = x  # = left
-        self.y = y  # = top
-        self.width = width
-        self.height = height
+    def __len__(self):
 
-        self.top = self.y
-        self.bottom = self.y - height
-        self.left = self.x
-        self.right = self.x + width
+        return len(self.obs_type)
 
-        self.obs_type = obs_type
+    @classmethod
+    def generate(cls, rng, length):
+        """
+        Generates a tape of length obstacle sets drawn from rng, a
+        random.Random instance. The sets are the same as length calls to
+        generate_obstacle_set(rng) would give.
+        """
+
+        tape = cls(np.zeros(length, dtype=np.int8), np.zeros(length, dtype=np.int64),
+                   np.zeros((length, MAX_SET_SIZE), dtype=np.int64),
+                   np.zeros(length, dtype=np.int64), np.zeros(length, dtype=np.int64))
+        tape._draw(rng)
 
-    def move(self):
+        return tape
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a tape saved with save().
+        """
+        with np.load(path) as data:
+            return cls(data["obs_type"], data["count"], data["left"],
+                       data["width"], data["height"])
+
+    def save(self, path):
+        """
+        Saves the tape to path as a .npz file.
+        """
+        np.savez(path, obs_type=self.obs_type, count=self.count, left=self.left,
+                 width=self.width, height=self.height)
+
+    def refill(self, rng, length):
+        """
+        Replaces the tape with length obstacle sets drawn from rng, like
+        generate(), reusing the storage of the tape if it is long enough.
         """
-        Moves the obstacle down, towards the player.
+        if len(self) < length:
+            new = ObstacleTape.generate(rng, length)
+            self.obs_type, self.count, self.left = new.obs_type, new.count, new.left
+            self.width, self.height = new.width, new.height
+            return
+
+        self.obs_type = self.obs_type[:length]
+        self.count = self.count[:length]
+        self.left = self.left[:length]
+        self.width = self.width[:length]
+        self.height = self.height[:length]
+        self.left.fill(0)
+        self._draw(rng)
+
+    def extend(self, rng, length):
         """
-        self.y += OBS_VEL
-        self.top += OBS_VEL
-        self.bottom += OBS_VEL
+        Appends length obstacle sets drawn from rng to the tape.
+        """
+        new = ObstacleTape.generate(rng, length)
+
+        self.obs_type = np.concatenate((self.obs_type, new.obs_type))
+        self.count = np.concatenate((self.count, new.count))
+        self.left = np.concatenate((self.left, new.left))
+        self.width = np.concatenate((self.width, new.width))
+        self.height = np.concatenate((self.height, new.height))
+
+    def _draw(self, rng):
+        """
+        Overwrites every obstacle set on the tape with one drawn from rng.
+        """
+        for row in range(len(self)):
+            set_type, spawn_xs, self.width[row], self.height[row] = generate_obstacle_set(rng)
+            self.obs_type[row] = set_type.value
+            self.count[row] = len(spawn_xs)
+            self.left[row, :len(spawn_xs)] = spawn_xs
+
+
+class Obstacle(object):
+    """
+    An obstacle in the Duet game, as a view of one obstacle stored in an
+    ObstacleManager.
+    """
+
+    def __init__(self, manager, slot, index):
+
+        self.manager = manager
+        self.slot = slot
+        self.index = index
+
+    @property
+    def x(self):  # = left
+        return int(self.manager.left[self.slot, self.index])
+
+    @property
+    def y(self):  # = top
+        return self.manager.set_top(self.slot)
+
+    @property
+    def width(self):
+        return self.right - self.left
+
+    @property
+    def height(self):
+        return int(self.manager.height[self.slot])
+
+    @property
+    def top(self):
+        return self.y
+
+    @property
+    def bottom(self):
+        return self.y - self.height
+
+    @property
+    def left(self):
+        return self.x
+
+    @property
+    def right(self):
+        return int(self.manager.right[self.slot, self.index])
+
+    @property
+    def obs_type(self):
+        return ObstacleType(self.manager.obs_type[self.slot])
 
     def out_of_frame(self):
         """
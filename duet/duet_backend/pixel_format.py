@@ -0,0 +1,58 @@
+import numpy as np
+from gym import spaces
+
+
+class PixelFormat(object):
+    """
+    Layout of pixel states.
+
+    Drawn frames are grey scale, so a frame is computed once as a single
+    (height, width) channel of values in 0-255 and written to the state in
+    one operation that broadcasts it to the channels of the state, moves
+    the channels to the chosen axis and casts it to the chosen dtype.
+
+    pixel_size is the (height, width) of a state. With grayscale the state
+    has a single channel instead of three equal RGB channels, and with
+    channels_first the channels come first (CHW) instead of last (HWC).
+    Integer dtypes hold values in 0-255 and float dtypes values in 0-1.
+    """
+
+    def __init__(self, pixel_size=(84, 84), grayscale=False, channels_first=False, pixel_dtype=np.uint8):
+
+        self.size = tuple(int(n) for n in pixel_size)
+        if len(self.size) != 2 or min(self.size) < 1:
+            raise ValueError("Invalid pixel size {}".format(pixel_size))
+
+        self.grayscale = grayscale
+        self.channels_first = channels_first
+        self.n_channels = 1 if grayscale else 3
+        if channels_first:
+            self.shape = (self.n_channels,) + self.size
+        else:
+            self.shape = self.size + (self.n_channels,)
+
+        self.dtype = np.dtype(pixel_dtype)
+        if self.dtype.kind in "ui":
+            self.high = 255
+        elif self.dtype.kind == "f":
+            self.high = 1.0
+        else:
+            raise ValueError("Invalid pixel dtype '{}'".format(self.dtype))
+
+    def space(self):
+        """
+        Returns the observation space of a single state.
+        """
+        return spaces.Box(low=0, high=self.high, shape=self.shape, dtype=self.dtype)
+
+    def write(self, frame, out):
+        """
+        Writes frame, a (height, width) array of values in 0-255, to out,
+        an array of shape self.shape and dtype self.dtype.
+        """
+        frame = frame[None] if self.channels_first else frame[..., None]
+        if self.high == 255:
+            np.copyto(out, frame, casting="unsafe")
+        else:
+            np.multiply(frame, 1/255, out=out, casting="unsafe")
+        return out
@@ -0,0 +1,80 @@
+import functools
+import time
+
+
+class PhaseProfiler(object):
+    """
+    Collects the cumulative time and number of calls of the phases of a
+    game step.
+
+    Phases are methods of an object that are wrapped with a timer on that
+    object only, so objects that are not instrumented run their methods
+    untouched and pay nothing.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+
+        self.clock = clock
+
+        # phase name -> {"calls": int, "time": seconds}
+        self.stats = {}
+
+    def instrument(self, obj, phases):
+        """
+        Wraps the methods of obj named in phases with timers. Nested phases
+        are timed inclusively, e.g. the time of a draw includes the time of
+        its draw calls.
+        """
+        for phase in phases:
+            self.stats[phase] = {"calls": 0, "time": 0.0}
+            setattr(obj, phase, self._timed(phase, getattr(obj, phase)))
+
+    def uninstrument(self, obj):
+        """
+        Removes the timers added to obj by instrument().
+        """
+        for phase in self.stats:
+            obj.__dict__.pop(phase, None)
+
+    def reset(self):
+        """
+        Sets all timers and call counts back to zero.
+        """
+        for stat in self.stats.values():
+            stat["calls"] = 0
+            stat["time"] = 0.0
+
+    def snapshot(self):
+        """
+        Returns a copy of the stats, which later calls do not change.
+        """
+        return {phase: dict(stat) for phase, stat in self.stats.items()}
+
+    def summary(self):
+        """
+        Returns the phases as a list of (phase, calls, total time, time per
+        call), most expensive phase first.
+        """
+        rows = [(phase, stat["calls"], stat["time"],
+                 stat["time"]/stat["calls"] if stat["calls"] else 0.0)
+                for phase, stat in self.stats.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def _timed(self, phase, method):
+        """
+        Returns method wrapped so that its calls are counted and timed
+        under phase.
+        """
+        stat = self.stats[phase]
+        clock = self.clock
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stat["time"] += clock() - start
+                stat["calls"] += 1
+
+        return timed
@@ -0,0 +1,168 @@
+import numpy as np
+
+import contextlib
+with contextlib.redirect_stdout(None):
+    import pygame
+
+from gym.envs.duet.duet_backend.ball import BALL_RADIUS
+
+BOARD_HEIGHT = 960
+BOARD_WIDTH = 540
+
+CIRCLE_RADIUS = 100   # distance from either ball to center
+CIRCLE_WIDTH = 1  # width of grey circle
+DIST_TO_BOTTOM = CIRCLE_RADIUS + 15  # dist from ball to bottom of screen
+
+SCORE_POS = (10, BOARD_HEIGHT-25)
+
+WHITE = (255, 255, 255)
+
+
+class Rasterizer(object):
+    """
+    Draws the Duet board straight into a low resolution numpy array.
+
+    Every cell of the output holds the fraction of its board pixels that
+    are covered by the circle, the balls, the obstacles or the score,
+    scaled to 0-255. This is what resizing the full screen gives, since
+    the screen is converted to a grey scale image where every non-black
+    pixel is white.
+
+    Only shapes that move are rasterized per frame. The circle and the
+    ball and score shapes are drawn with pygame once and reused. With
+    draw_rects, balls are drawn with their bounding boxes like
+    Ball.draw() does.
+    """
+
+    def __init__(self, shape=(84, 84), draw_rects=False):
+
+        self.shape = tuple(shape)
+        height, width = self.shape
+
+        # Every board pixel belongs to the output cell containing its center
+        self.row_cell = ((np.arange(BOARD_HEIGHT) + 0.5)*height/BOARD_HEIGHT).astype(np.int64)
+        self.col_cell = ((np.arange(BOARD_WIDTH) + 0.5)*width/BOARD_WIDTH).astype(np.int64)
+        rows_per_cell = np.bincount(self.row_cell, minlength=height)
+        cols_per_cell = np.bincount(self.col_cell, minlength=width)
+        self.row_start = np.concatenate(([0], np.cumsum(rows_per_cell)[:-1]))
+        self.row_end = self.row_start + rows_per_cell
+        self.col_start = np.concatenate(([0], np.cumsum(cols_per_cell)[:-1]))
+        self.col_end = self.col_start + cols_per_cell
+        self.cell_area = np.outer(rows_per_cell, cols_per_cell).astype(np.float32)
+
+        self.frame = np.zeros(self.shape, dtype=np.float32)
+
+        board = pygame.Surface((BOARD_WIDTH, BOARD_HEIGHT))
+        pygame.draw.circle(board, WHITE,
+                           (BOARD_WIDTH//2, BOARD_HEIGHT - DIST_TO_BOTTOM),
+                           CIRCLE_RADIUS, CIRCLE_WIDTH)
+        self.background = np.zeros(self.shape, dtype=np.float32)
+        self._stamp(self.background, _surface_mask(board), 0, 0)
+
+        ball = pygame.Surface((2*BALL_RADIUS, 2*BALL_RADIUS))
+        if draw_rects:
+            ball.fill(WHITE)
+        else:
+            pygame.draw.circle(ball, WHITE, (BALL_RADIUS, BALL_RADIUS), BALL_RADIUS)
+        self.ball_mask = _surface_mask(ball)
+
+        self.score_font = None
+        self.score_masks = {}
+
+    def draw_frame(self, ball_positions, obstacle_rects, score):
+        """
+        Draws the board and returns it as a single (height, width) channel
+        of float32 values in 0-255. The returned array is overwritten by
+        the next draw.
+
+        ball_positions holds the (x, y) center of each ball and
+        obstacle_rects the (left, right, top, bottom) edges of each
+        obstacle, with bottom being the lower edge on the screen.
+        """
+
+        frame = self.frame
+        np.copyto(frame, self.background)
+
+        for left, right, top, bottom in obstacle_rects:
+            self._draw_rect(frame, left, right, top, bottom)
+
+        for x, y in ball_positions:
+            self._stamp(frame, self.ball_mask, x - BALL_RADIUS, y - BALL_RADIUS)
+
+        self._stamp(frame, self._score_mask(score), *SCORE_POS)
+
+        np.multiply(frame, 255, out=frame)
+        np.rint(frame, out=frame)
+
+        return frame
+
+    def _draw_rect(self, frame, left, right, top, bottom):
+        """
+        Adds the coverage of the rectangle spanning [left, right) x
+        [top, bottom) on the board to frame.
+        """
+
+        left, right = max(left, 0), min(right, BOARD_WIDTH)
+        top, bottom = max(top, 0), min(bottom, BOARD_HEIGHT)
+        if left >= right or top >= bottom:
+            return
+
+        r0, r1 = self.row_cell[top], self.row_cell[bottom - 1] + 1
+        c0, c1 = self.col_cell[left], self.col_cell[right - 1] + 1
+
+        rows = (np.minimum(self.row_end[r0:r1], bottom) -
+                np.maximum(self.row_start[r0:r1], top))
+        cols = (np.minimum(self.col_end[c0:c1], right) -
+                np.maximum(self.col_start[c0:c1], left))
+
+        coverage = np.outer(rows, cols) / self.cell_area[r0:r1, c0:c1]
+        np.maximum(frame[r0:r1, c0:c1], coverage, out=frame[r0:r1, c0:c1])
+
+    def _stamp(self, frame, mask, x, y):
+        """
+        Adds the coverage of the board pixel mask, with its top left corner
+        at (x, y) on the board, to frame.
+        """
+
+        height, width = mask.shape
+        x0, x1 = max(x, 0), min(x + width, BOARD_WIDTH)
+        y0, y1 = max(y, 0), min(y + height, BOARD_HEIGHT)
+        if x0 >= x1 or y0 >= y1:
+            return
+        mask = mask[y0 - y:y1 - y, x0 - x:x1 - x]
+
+        rows = self.row_cell[y0:y1]
+        cols = self.col_cell[x0:x1]
+        row_splits = np.flatnonzero(np.diff(rows)) + 1
+        col_splits = np.flatnonzero(np.diff(cols)) + 1
+
+        counts = np.add.reduceat(mask, np.concatenate(([0], row_splits)), axis=0)
+        counts = np.add.reduceat(counts, np.concatenate(([0], col_splits)), axis=1)
+
+        r0, r1 = rows[0], rows[-1] + 1
+        c0, c1 = cols[0], cols[-1] + 1
+        coverage = counts / self.cell_area[r0:r1, c0:c1]
+        np.maximum(frame[r0:r1, c0:c1], coverage, out=frame[r0:r1, c0:c1])
+
+    def _score_mask(self, score):
+        """
+        Returns the board pixel mask of the rendered score, rendering it
+        only the first time it is needed.
+        """
+
+        mask = self.score_masks.get(score)
+        if mask is None:
+            if self.score_font is None:
+                pygame.font.init()
+                self.score_font = pygame.font.Font("freesansbold.ttf", 20)
+            mask = _surface_mask(self.score_font.render(str(score), False, WHITE))
+            self.score_masks[score] = mask
+
+        return mask
+
+
+def _surface_mask(surface):
+    """
+    Returns a (height, width) array that is 1 where surface is not black.
+    """
+    return (pygame.surfarray.array2d(surface).T != 0).astype(np.float32)
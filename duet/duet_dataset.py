@@ -0,0 +1,347 @@
+import io
+import json
+import os
+
+import numpy as np
+
+from gym.envs.duet.duet_recording import json_config
+
+INDEX_FILE = "index.json"
+SHARD_SIZE = 100000
+INITIAL_SHARD_ROWS = 1024
+
+
+class TrajectoryWriter(object):
+    """
+    Streams the trajectories of a DuetGame to a dataset of memory-mapped
+    .npy shards in directory, for offline RL.
+
+    The writer attaches itself to game and writes one row per state: the
+    first state of every episode, and the state after every step together
+    with the action, reward and game over of that step. Every state is thus
+    stored once, and the transitions are the pairs of consecutive rows of
+    an episode. With frame stacking only the newest state of every stack
+    is stored, and TrajectoryDataset rebuilds the stacks.
+
+    Rows are written to shards of at most shard_size rows, and a new shard
+    is started whenever one is full. Shards are preallocated on disk for
+    INITIAL_SHARD_ROWS rows, and their capacity is doubled whenever they
+    fill up, so storage grows with the dataset. close() trims the last
+    shard to the rows written. index.json lists the shards and the number
+    of rows in each, and is updated when a shard is started and on flush()
+    and close().
+    """
+
+    def __init__(self, game, directory, shard_size=SHARD_SIZE):
+
+        if not game.capture:
+            raise ValueError("Trajectories can only be written from games that capture states")
+
+        self.game = game
+        self.directory = directory
+        self.shard_size = shard_size
+        os.makedirs(directory, exist_ok=True)
+
+        state = game.state_buffer
+        self.fields = {
+            "states": (state.shape, state.dtype),
+            "actions": ((), np.dtype(np.uint8)),
+            "rewards": ((), np.dtype(np.float32)),
+            "dones": ((), np.dtype(bool)),
+            "firsts": ((), np.dtype(bool)),
+        }
+
+        self.frame_stack = 1
+        self.channel_axis = -1
+        if game.frame_stack is not None:
+            self.frame_stack = game.frame_stack.n_frames
+            self.channel_axis = 0 if game.state_rep == "pixel" and game.pixel_format.channels_first else -1
+
+        self.shards = []
+        self.arrays = None
+        self.row = shard_size
+        self.capacity = shard_size
+        self.n_rows = 0
+
+        game.attach(self)
+
+    def on_reset(self, game, state):
+        """
+        Writes the first state of an episode.
+        """
+        self._write(game, state, 0, 0, False, True)
+
+    def on_step(self, game, state, reward, game_over, info):
+        """
+        Writes the state after a step, with the action, reward and game
+        over of the step.
+        """
+        if not self.n_rows:
+            raise RuntimeError("The game must be reset before it is written")
+
+        self._write(game, state, game.action if game.action in (1, 2) else 0,
+                    reward, game_over, False)
+
+    def flush(self):
+        """
+        Flushes the current shard to disk and updates the index.
+        """
+        if self.arrays is not None:
+            for array in self.arrays.values():
+                array.flush()
+        self._write_index()
+
+    def close(self):
+        """
+        Stops writing, trims the last shard to the rows written and flushes
+        the dataset.
+        """
+        self.game.detach(self)
+        if self.arrays is not None and self.row < self.capacity:
+            self._resize_shard(self.row)
+        self.flush()
+        self.arrays = None
+
+    def _write(self, game, state, action, reward, done, first):
+        """
+        Appends a row to the dataset, starting a new shard if needed.
+        """
+
+        if state is None:
+            raise RuntimeError("Trajectories can only be written while the game captures states")
+
+        if self.row == self.shard_size:
+            self._new_shard()
+        elif self.row == self.capacity:
+            self._resize_shard(min(2*self.capacity, self.shard_size))
+
+        if self.frame_stack > 1:
+            state = game.frame_stack.latest()
+
+        row = self.row
+        arrays = self.arrays
+        arrays["states"][row] = state
+        arrays["actions"][row] = action
+        arrays["rewards"][row] = reward
+        arrays["dones"][row] = done
+        arrays["firsts"][row] = first
+
+        self.row += 1
+        self.n_rows += 1
+        self.shards[-1]["rows"] = self.row
+
+    def _new_shard(self):
+        """
+        Flushes the current shard and preallocates the next one.
+        """
+
+        if self.arrays is not None:
+            for array in self.arrays.values():
+                array.flush()
+
+        number = len(self.shards)
+        capacity = min(INITIAL_SHARD_ROWS, self.shard_size)
+        files = {}
+        arrays = {}
+        for name, (shape, dtype) in self.fields.items():
+            files[name] = "{}_{:05d}.npy".format(name, number)
+            arrays[name] = np.lib.format.open_memmap(
+                os.path.join(self.directory, files[name]), mode="w+",
+                dtype=dtype, shape=(capacity,) + shape)
+
+        self.shards.append({"rows": 0, "files": files})
+        self.arrays = arrays
+        self.row = 0
+        self.capacity = capacity
+
+        self._write_index()
+
+    def _resize_shard(self, capacity):
+        """
+        Resizes the files of the current shard to capacity rows, keeping
+        the rows written.
+        """
+
+        for name in self.fields:
+            self.arrays[name].flush()
+            # The file is only resized once its memory map is closed
+            self.arrays[name] = None
+            path = os.path.join(self.directory, self.shards[-1]["files"][name])
+            self.arrays[name] = _resize_npy(path, capacity, self.row)
+
+        self.capacity = capacity
+
+    def _write_index(self):
+        """
+        Writes the index of the dataset.
+        """
+
+        index = {
+            "fields": {name: {"shape": list(shape), "dtype": dtype.str}
+                       for name, (shape, dtype) in self.fields.items()},
+            "frame_stack": self.frame_stack,
+            "channel_axis": self.channel_axis,
+            "config": json_config(self.game.config),
+            "shards": self.shards,
+        }
+
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(path + ".tmp", path)
+
+
+class TrajectoryDataset(object):
+    """
+    Reads a dataset written by TrajectoryWriter.
+
+    Shards are memory-mapped, so only the rows that are read are loaded.
+    The action, reward, done and first flags of all rows are small and
+    are loaded into memory to find the transitions and episode starts.
+    """
+
+    def __init__(self, directory):
+
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            index = json.load(f)
+
+        self.frame_stack = index["frame_stack"]
+        self.channel_axis = index["channel_axis"]
+        self.config = index["config"]
+        self.state_shape = tuple(index["fields"]["states"]["shape"])
+        self.state_dtype = np.dtype(index["fields"]["states"]["dtype"])
+
+        shards = [shard for shard in index["shards"] if shard["rows"]]
+        self.states = [np.load(os.path.join(directory, shard["files"]["states"]),
+                               mmap_mode="r")[:shard["rows"]] for shard in shards]
+        self.offsets = np.cumsum([0] + [shard["rows"] for shard in shards])
+
+        def load(name):
+            if not shards:
+                return np.zeros(0, dtype=index["fields"][name]["dtype"])
+            return np.concatenate([np.load(os.path.join(directory, shard["files"][name]),
+                                           mmap_mode="r")[:shard["rows"]] for shard in shards])
+
+        self.actions = load("actions")
+        self.rewards = load("rewards")
+        self.dones = load("dones")
+        self.firsts = load("firsts")
+
+        # First row of the episode of every row, and the rows that end a
+        # transition, i.e. all rows but the first of every episode
+        rows = np.arange(len(self.firsts))
+        self.episode_starts = np.maximum.accumulate(np.where(self.firsts, rows, 0))
+        self.transitions = np.flatnonzero(~self.firsts)
+
+    def __len__(self):
+
+        return len(self.transitions)
+
+    @property
+    def n_rows(self):
+        return int(self.offsets[-1])
+
+    def get_states(self, rows):
+        """
+        Returns the states of the rows in the array rows, stacked with the
+        states before them like the game stacked them if it used frame
+        stacking.
+        """
+
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.frame_stack == 1:
+            return self._gather(rows)
+
+        # The stack of a row holds the rows before it in its episode, with
+        # the first state of the episode repeated at its start
+        lags = np.arange(self.frame_stack - 1, -1, -1)
+        stack_rows = np.maximum(rows[:, None] - lags, self.episode_starts[rows][:, None])
+        frames = self._gather(stack_rows.ravel())
+        frames = frames.reshape(rows.shape + (self.frame_stack,) + frames.shape[1:])
+
+        # Move the stack axis next to the channel axis and merge them
+        channel_axis = self.channel_axis % (frames.ndim - 2) + 2
+        frames = np.moveaxis(frames, 1, channel_axis - 1)
+        shape = list(frames.shape)
+        shape[channel_axis - 1:channel_axis + 1] = [shape[channel_axis - 1]*shape[channel_axis]]
+        return frames.reshape(shape)
+
+    def get_transitions(self, indices):
+        """
+        Returns the transitions with the given indices, out of len(self),
+        as a dict of arrays of states, actions, rewards, next_states and
+        dones.
+        """
+        rows = self.transitions[np.asarray(indices, dtype=np.int64)]
+        return {
+            "states": self.get_states(rows - 1),
+            "actions": self.actions[rows],
+            "rewards": self.rewards[rows],
+            "next_states": self.get_states(rows),
+            "dones": self.dones[rows],
+        }
+
+    def sample(self, batch_size, rng=np.random):
+        """
+        Returns a minibatch of batch_size transitions drawn uniformly at
+        random with rng, like get_transitions().
+        """
+        return self.get_transitions(rng.randint(0, len(self), size=batch_size))
+
+    def _gather(self, rows):
+        """
+        Returns the states of the rows in the 1-d array rows, read from
+        their shards.
+        """
+
+        shards = np.searchsorted(self.offsets, rows, side="right") - 1
+        out = np.empty((len(rows),) + self.state_shape, dtype=self.state_dtype)
+        for shard in np.unique(shards):
+            selected = shards == shard
+            out[selected] = self.states[shard][rows[selected] - self.offsets[shard]]
+
+        return out
+
+
+def _resize_npy(path, rows, rows_kept):
+    """
+    Resizes the .npy file at path to rows rows along its first axis,
+    keeping its first rows_kept rows, and returns it memory-mapped.
+
+    Only the header and the length of the file change if the header keeps
+    its length, which it does unless the number of digits of rows pushes
+    it past its padding. Otherwise the rows are copied to a new file.
+    """
+
+    npy = np.lib.format
+
+    with open(path, "rb") as f:
+        version = npy.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = npy.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = npy.read_array_header_2_0(f)
+        offset = f.tell()
+
+    new_shape = (rows,) + shape[1:]
+    header = io.BytesIO()
+    header_data = {"shape": new_shape, "fortran_order": fortran_order,
+                   "descr": npy.dtype_to_descr(dtype)}
+    if version == (1, 0):
+        npy.write_array_header_1_0(header, header_data)
+    else:
+        npy.write_array_header_2_0(header, header_data)
+
+    if len(header.getvalue()) == offset:
+        with open(path, "r+b") as f:
+            f.write(header.getvalue())
+            f.truncate(offset + rows*int(np.prod(shape[1:]))*dtype.itemsize)
+        return np.load(path, mmap_mode="r+")
+
+    old = np.load(path, mmap_mode="r")
+    new = npy.open_memmap(path + ".tmp", mode="w+", dtype=dtype, shape=new_shape)
+    new[:rows_kept] = old[:rows_kept]
+    new.flush()
+    del old, new
+    os.replace(path + ".tmp", path)
+    return np.load(path, mmap_mode="r+")
@@ -1,11 +1,19 @@
+import random
+
 import numpy as np
 from PIL import Image
 import gym
 from gym import spaces
 
-from gym.envs.duet.duet_backend.ball import Ball
-from gym.envs.duet.duet_backend.obstacle_manager import ObstacleManager
+from gym.envs.duet.duet_backend.ball import Ball, BALL_RADIUS, n_spin_angles
+from gym.envs.duet.duet_backend.obstacle_manager import (ObstacleManager, OBS_VEL,
+                                                         OBSTACLE_STATE_DTYPE, episode_seed)
+from gym.envs.duet.duet_backend.collision_table import get_collision_table
 from gym.envs.duet.duet_backend.controller import Controller
+from gym.envs.duet.duet_backend.frame_stack import FrameStack
+from gym.envs.duet.duet_backend.profiler import PhaseProfiler
+from gym.envs.duet.duet_backend.pixel_format import PixelFormat
+from gym.envs.duet.duet_backend.rasterizer import Rasterizer
 
 import contextlib
 with contextlib.redirect_stdout(None):
@@ -22,9 +30,26 @@ SPIN_STEP = 0.0224  # angular step of player balls in radians
 
 NEW_OBS_INTERVAL = 140
 
+MAX_UPDATE_RECTS = 64  # above this render() updates the whole window
+RENDER_DELAY = 10  # milliseconds render() waits after updating the window
+
 PIXEL_STATE_SHAPE = (84, 84, 3)
 COORD_STATE_SHAPE = (12,)
 
+# Record holding the full state of a game, see DuetGame.get_state()
+GAME_STATE_DTYPE = np.dtype([
+    ("score", np.int64),
+    ("i", np.int64),
+    ("episode", np.int64),
+    ("angles", np.int64, (2,)),  # blue, red
+    ("obstacles", OBSTACLE_STATE_DTYPE),
+])
+
+# Methods timed when profiling, see DuetGame.man_init()
+PROFILED_PHASES = ("step", "step_until", "render", "_step_frame", "_move_balls",
+                   "_move_obstacles", "_collided", "_get_pixel_state",
+                   "_get_coord_state", "_draw")
+
 
 # Colors
 WHITE = (255, 255, 255)
@@ -44,9 +69,14 @@ class DuetGame(gym.Env):
     reward_range = (0, 1)
     action_space = spaces.Discrete(3)
 
-    def __init__(self, mode="ai", capture=True):
+    def __init__(self, mode="ai", capture=True, headless=False):
+        """
+        If headless is True, the game is drawn to an offscreen surface and
+        pygame.display is not touched until render() is called.
+        """
 
-        pygame.init()
+        if not headless:
+            pygame.init()
 
         self.mode = mode
         self.capture = capture
@@ -57,22 +87,88 @@ class DuetGame(gym.Env):
         elif self.mode == "ai":
             self.action = None
 
-        self.screen = pygame.display.set_mode((BOARD_WIDTH, BOARD_HEIGHT))
-        pygame.display.set_caption("Duet Game")
+        self.window = None
+        self._init_screen(headless)
 
         self.score = 0
         self.i = 1
+        self.frame_dirty = True
+        self.profiler = None
+        self.listeners = []
+        self.render_delay = RENDER_DELAY
+
+        self.seed()
 
         pygame.font.init()
         self.score_font = pygame.font.Font("freesansbold.ttf", 20)
         self.game_over_font = pygame.font.Font("freesansbold.ttf", 80)
         self.restart_font = pygame.font.Font("freesansbold.ttf", 20)
-
-    def man_init(self, state_rep="pixel", mode="ai", capture=True, n_repeat_action=1, random_obstacles=True, draw_rects=False, visualize=False):
+        self.score_surfaces = {}
+
+    def man_init(self, state_rep="pixel", mode="ai", capture=True, n_repeat_action=1,
+                 random_obstacles=True, draw_rects=False, visualize=False,
+                 collision="box", pixel_backend="pygame",
+                 copy_state=True, max_pool=False,
+                 tape=None, collision_table=False,
+                 profile=False, headless=None,
+                 pixel_size=(84, 84), grayscale=False, channels_first=False, pixel_dtype=np.uint8,
+                 frame_stack=1):
         """
         For manual initialization after calling gym.make().
+
+        collision is either "box", where obstacles collide with the
+        bounding box of the balls, or "circle", where they collide with
+        the balls themselves.
+
+        pixel_backend is either "pygame", where pixel states are resized
+        from the drawn screen, or "numpy", where they are rasterized
+        directly at the state resolution without drawing the screen.
+
+        States are written to a buffer that is allocated once. If
+        copy_state is False, step() and reset() return that buffer itself,
+        which is overwritten by the next call, instead of a copy of it.
+
+        With n_repeat_action > 1, only the frames that end up in the state
+        are drawn. If max_pool is True, the pixel state is the pixelwise
+        maximum of the last two frames.
+
+        If tape is given, every episode reads its obstacle sets from that
+        ObstacleTape instead of generating them.
+
+        If collision_table is True, collisions are looked up in a
+        precomputed CollisionTable instead of being tested geometrically.
+        collision_table can also be the path of a file the table is cached
+        in.
+
+        If profile is True, the calls to and the time spent in each phase
+        of a step (see PROFILED_PHASES) are counted in self.profiler.stats,
+        and step() and step_until() pass a copy of them as info["profile"].
+        The copy is taken before the timer of the step call itself stops.
+        Without profiling, no timers are installed at all.
+
+        If headless is True, the game is drawn to an offscreen surface
+        instead of a window, and no window is opened unless render() is
+        called. If headless is None, it is kept as given to __init__().
+        Manual mode needs a window and cannot be headless.
+
+        pixel_size, grayscale, channels_first and pixel_dtype set the
+        format of pixel states, see PixelFormat. The defaults give
+        PIXEL_STATE_SHAPE uint8 RGB states.
+
+        With frame_stack > 1, states are the last frame_stack states
+        stacked along the channel axis, kept in a FrameStack. The stacked
+        state is a view of the FrameStack if copy_state is False, and the
+        newest single state is frame_stack.latest(). step() and
+        step_until() pass its index as info["frame_index"], so replay
+        buffers can store every state once. On reset the stack is filled
+        with the first state.
+
+        The arguments are kept in self.config, so that the game can be
+        recreated, e.g. to replay a recorded episode.
         """
 
+        self.config = {name: value for name, value in locals().items() if name != "self"}
+
         self.mode = mode
         self.capture = capture
 
@@ -81,52 +177,122 @@ class DuetGame(gym.Env):
         elif self.mode == "ai":
             self.action = None
 
+        if headless is None:
+            headless = self.headless
+        if headless and self.mode == "man":
+            raise ValueError("Manual mode cannot be headless")
+        self._init_screen(headless)
+
         self.state_rep = state_rep
+        self.pixel_format = PixelFormat(pixel_size, grayscale, channels_first, pixel_dtype)
         if self.state_rep == "pixel":
-            DuetGame.observation_space = spaces.Box(low=0, high=255, shape=PIXEL_STATE_SHAPE, dtype=np.uint8)
+            self.observation_space = self.pixel_format.space()
+            self.state_buffer = np.zeros(self.pixel_format.shape, dtype=self.pixel_format.dtype)
         else:
-            DuetGame.observation_space = spaces.Box(low=0, high=BOARD_HEIGHT, shape=COORD_STATE_SHAPE, dtype=np.uint8)
+            self.observation_space = spaces.Box(low=0, high=BOARD_HEIGHT, shape=COORD_STATE_SHAPE, dtype=np.uint8)
+            self.state_buffer = np.zeros(COORD_STATE_SHAPE, dtype=np.int64)
+        self.copy_state = copy_state
+
+        self.frame_stack = None
+        if frame_stack > 1:
+            channel_axis = 0 if self.state_rep == "pixel" and channels_first else -1
+            self.frame_stack = FrameStack(frame_stack, self.state_buffer.shape,
+                                          self.state_buffer.dtype, channel_axis)
+            space = self.observation_space
+            self.observation_space = spaces.Box(low=0, high=space.high.flat[0],
+                                                shape=self.frame_stack.stacked_shape,
+                                                dtype=space.dtype)
+
+        # Snapshots of games with frame stacking also hold the stacked frames
+        self.state_dtype = GAME_STATE_DTYPE
+        if self.frame_stack is not None:
+            fields = [(name, GAME_STATE_DTYPE.fields[name][0]) for name in GAME_STATE_DTYPE.names]
+            fields.append(("frames", self.state_buffer.dtype, (frame_stack,) + self.state_buffer.shape))
+            self.state_dtype = np.dtype(fields)
+
+        if max_pool and self.state_rep != "pixel":
+            raise ValueError("Max pooling requires pixel states")
+        self.max_pool = max_pool and n_repeat_action > 1
+        if self.max_pool:
+            self.pool_buffer = np.zeros_like(self.state_buffer)
 
         self.n_repeat_action = n_repeat_action
 
         self.random_obstacles = random_obstacles
-        self.obstacle_manager = ObstacleManager(random_obstacles)
+        self.tape = tape
+        self.obstacle_manager = ObstacleManager(random_obstacles, tape=tape)
+        # The board is set up for the next episode without using up its
+        # number, which the next reset() uses
+        self._create_obstacle_manager(self.episode)
         self.obstacle_manager.new_obstacle_set()
 
         self.draw_rects = draw_rects
+        self.collision = collision
         self._init_balls(draw_rects)
 
+        self.collision_table = None
+        if collision_table:
+            cache_path = collision_table if isinstance(collision_table, str) else None
+            self.collision_table = get_collision_table(
+                collision, n_spin_angles(SPIN_STEP),
+                (BOARD_WIDTH//2, BOARD_HEIGHT - DIST_TO_BOTTOM), CIRCLE_RADIUS, cache_path)
+            if tape is not None and not self.collision_table.matches(tape):
+                raise ValueError("Tape holds obstacle sets the collision table does not cover")
+
         self.visualize = visualize
 
-    def reset(self):
+        if pixel_backend == "numpy":
+            self.rasterizer = Rasterizer(self.pixel_format.size, draw_rects)
+        elif pixel_backend != "pygame":
+            raise ValueError("Invalid pixel backend '{}'".format(pixel_backend))
+        self.pixel_backend = pixel_backend
+
+        if self.profiler is not None:
+            self.profiler.uninstrument(self)
+            self.profiler = None
+        if profile:
+            self.profiler = PhaseProfiler()
+            self.profiler.instrument(self, PROFILED_PHASES)
+
+    def reset(self, out=None):
         """
         Resets the game.
-        """
-        self.screen = pygame.display.set_mode((BOARD_WIDTH, BOARD_HEIGHT))
-        pygame.display.set_caption("Duet Game")
 
+        The screen, fonts, balls and obstacle manager are reused, and only
+        the state of the game is reinitialized.
+
+        If out is given, the initial state is written to it and out is
+        returned.
+        """
         self.score = 0
         self.i = 1
+        self.frame_dirty = True
 
-        self._init_balls(self.draw_rects)
-        self.obstacle_manager = ObstacleManager(self.random_obstacles)
-        self.obstacle_manager.new_obstacle_set()
+        self.blue_ball.reset()
+        self.red_ball.reset()
+        self._new_obstacle_manager()
 
-        pygame.font.init()
-        self.score_font = pygame.font.Font("freesansbold.ttf", 20)
-        self.game_over_font = pygame.font.Font("freesansbold.ttf", 80)
-        self.restart_font = pygame.font.Font("freesansbold.ttf", 20)
+        # The controller must not keep views of the obstacle sets of the
+        # last episode, whose slots are reused
+        if self.mode == "contr":
+            self.controller = Controller()
 
+        state = None
         if self.capture:
-            if self.state_rep == "coord":
-                return self._get_coord_state()
-            elif self.state_rep == "pixel":
-                return self._get_pixel_state()
+            state = self._capture_observation(out, new_episode=True)
+
+        for listener in self.listeners:
+            listener.on_reset(self, state)
 
-    def step(self, action):
+        return state
+
+    def step(self, action, out=None):
         """
         Performs action (idle, spin clockwise or spin counter-clockwise) in the game
         and returns the resulting (new_state, reward, game_over).
+
+        If out is given, the new state is written to it and out is
+        returned as new_state.
         """
 
         game_over = False
@@ -136,57 +302,243 @@ class DuetGame(gym.Env):
 
         for i in range(self.n_repeat_action):
 
-            # Move the player balls
-            self._move_balls()
+            scored, collided = self._step_frame()
 
-            # Move all obstacles downward
-            self._move_obstacles()
-
-            # If an obstacle went out of frame, delete it
-            if self.obstacle_manager.oldest_out_of_frame():
-                self.obstacle_manager.remove_obstacle_set()
-                self.score += 1
+            if scored:
                 reward = 1
 
-            # If it is time, make a new obstacle
-            if self.i % NEW_OBS_INTERVAL == 0:
-                self.obstacle_manager.new_obstacle_set()
-
-            # Draw the game
-            self.screen.fill(BLACK)
-            self._draw_circle()
-            self._draw_balls()
-            self._draw_obstacles()
-            self._draw_score()
-
             # If either ball has collided, quit
-            oldest_obstacle_set = self.obstacle_manager.oldest_obstacle_set()
-            for obstacle in oldest_obstacle_set:
-                if self.blue_ball.collided_with(obstacle):
-                    game_over = True
-                    reward = 0
-                if self.red_ball.collided_with(obstacle):
-                    game_over = True
-                    reward = 0
-
-            self.i += 1
-            self.i = self.i % NEW_OBS_INTERVAL
+            if collided:
+                game_over = True
+                reward = 0
+
+            if self.max_pool and self.capture and i == self.n_repeat_action - 2:
+                self._get_observation(self.pool_buffer)
 
             if self.visualize and i != self.n_repeat_action - 1:
                 self.render()
 
         state = None
         if self.capture:
-            if self.state_rep == "coord":
-                state = self._get_coord_state()
-            elif self.state_rep == "pixel":
-                state = self._get_pixel_state()
+            state = self._capture_observation(out, pool=self.max_pool)
+
+        info = {}
+        if self.frame_stack is not None:
+            info["frame_index"] = self.frame_stack.frame_index - 1
+        if self.profiler is not None:
+            info["profile"] = self.profiler.snapshot()
+
+        for listener in self.listeners:
+            listener.on_step(self, state, reward, game_over, info)
+
+        return (state, reward, game_over, info)
+
+    def step_until(self, action, max_frames, out=None):
+        """
+        Performs action every frame until the next event, that is until an
+        obstacle set spawns or leaves the board or a ball collides, or until
+        max_frames frames have passed. Returns (new_state, reward,
+        game_over, info) like step(), with the reward accumulated over the
+        frames and the number of frames in info["frames"].
+
+        When the balls are idle, the frames up to the next event are
+        skipped analytically instead of being simulated one by one.
+        """
+
+        game_over = False
+        reward = 0
+        frames = 0
+
+        self.action = action
+        idle = self.mode == "ai" and action not in (1, 2)
+
+        while frames < max_frames:
+
+            if idle:
+                n_skip = min(self._frames_to_event(), max_frames - frames) - 1
+                self._skip_frames(n_skip)
+                frames += n_skip
+
+            spawned = self.i % NEW_OBS_INTERVAL == 0
+            scored, collided = self._step_frame()
+            frames += 1
+
+            if collided:
+                game_over = True
+            elif scored:
+                reward += 1
+
+            if spawned or scored or collided:
+                break
+
+        state = None
+        if self.capture:
+            state = self._capture_observation(out)
+
+        info = {"frames": frames}
+        if self.frame_stack is not None:
+            info["frame_index"] = self.frame_stack.frame_index - 1
+        if self.profiler is not None:
+            info["profile"] = self.profiler.snapshot()
+
+        for listener in self.listeners:
+            listener.on_step(self, state, reward, game_over, info)
+
+        return (state, reward, game_over, info)
+
+    def attach(self, listener):
+        """
+        Attaches listener to the game. After every reset, listener.on_reset(
+        game, state) is called, and after every step or step_until,
+        listener.on_step(game, state, reward, game_over, info). The action
+        taken is game.action.
+        """
+        self.listeners.append(listener)
+
+    def detach(self, listener):
+        """
+        Detaches a listener attached with attach().
+        """
+        self.listeners.remove(listener)
+
+    def seed(self, seed=None, index=0):
+        """
+        Seeds the obstacle generator of the game, which is only used with
+        random obstacles.
+
+        Every episode gets its own obstacle generator, seeded from seed,
+        index and the number of the episode. Games sharing a seed but with
+        different indices, such as the games of a vector env, therefore get
+        independent and reproducible obstacle sequences. If seed is None, a
+        random seed is used.
+        """
+        if seed is None:
+            seed = random.SystemRandom().randrange(2**63)
+
+        self.obstacle_seed = seed
+        self.seed_index = index
+        self.episode = 0
+
+        return [seed]
+
+    def get_state(self, out=None):
+        """
+        Returns the full state of the game as a numpy record of dtype
+        self.state_dtype, written to out if given.
+
+        The record is small and of fixed size, so a game can be cloned and
+        restored cheaply with set_state(), e.g. for tree search. The state of
+        the controller in "contr" mode is not included.
+
+        Without frame stacking the dtype is GAME_STATE_DTYPE. With frame
+        stacking the record also holds the stacked frames, oldest first, in
+        its "frames" field, so restored games return the same stacked
+        states as the game the snapshot was taken from. This makes records
+        of stacked pixel states much larger.
+        """
+
+        if out is None:
+            out = np.zeros((), dtype=self.state_dtype)
+
+        out["score"] = self.score
+        out["i"] = self.i
+        out["episode"] = self.obstacle_episode
+        out["angles"] = (self.blue_ball.angle, self.red_ball.angle)
+        self.obstacle_manager.get_state(out["obstacles"])
+        if self.frame_stack is not None:
+            self.frame_stack.frames(out["frames"])
+
+        return out
+
+    def set_state(self, state):
+        """
+        Restores the game to a state returned by get_state().
+
+        The state must come from a game with the same seed, or with the same
+        tape. Obstacles of other episodes than the current one are
+        regenerated from the seed.
+
+        With frame stacking, the stacked frames of the record are restored.
+        A record of dtype GAME_STATE_DTYPE holds no frames, and the stack is
+        then filled with the observation of the restored state, as on reset.
+        """
+
+        self.score = int(state["score"])
+        self.i = int(state["i"])
+        self.blue_ball.set_angle(int(state["angles"][0]))
+        self.red_ball.set_angle(int(state["angles"][1]))
+
+        episode = int(state["episode"])
+        if episode != self.obstacle_episode:
+            self._create_obstacle_manager(episode)
+        self.obstacle_manager.set_state(state["obstacles"])
+
+        self.frame_dirty = True
+
+        if self.frame_stack is not None:
+            if "frames" in state.dtype.names:
+                self.frame_stack.fill(state["frames"])
+            else:
+                self._capture_observation(new_episode=True)
+
+    def state_key(self):
+        """
+        Returns a canonical integer key of the state of the game, for
+        transposition tables in search. Two states with the same key
+        evolve identically under the same actions.
+
+        The key packs the ball angles (9 bits each), the spawn counter (8
+        bits), the frames since the oldest obstacle set spawned (11 bits),
+        the number of obstacle sets (3 bits), the tape cursor (32 bits) and,
+        if the obstacles differ between episodes, the episode. The positions
+        of all obstacle sets follow from these, since they spawn at a fixed
+        interval. The score is not part of the key.
+        """
+
+        manager = self.obstacle_manager
+
+        if manager.fixed_tape:
+            episode, cursor = 0, manager.cursor % len(manager.tape)
+        elif not self.random_obstacles:
+            episode, cursor = 0, manager.cursor
+        else:
+            episode, cursor = self.obstacle_episode, manager.cursor
+
+        age = manager.t - int(manager.spawn_t[manager.head]) if manager.size else 0
 
-        return (state, reward, game_over, {})
+        key = episode << 32 | cursor
+        key = key << 3 | manager.size
+        key = key << 11 | age
+        key = key << 8 | self.i
+        key = key << 9 | self.blue_ball.angle
+        key = key << 9 | self.red_ball.angle
+
+        return key
 
     def render(self, mode='human', close=False):
-        pygame.display.update()
-        pygame.time.delay(10)
+        if self.frame_dirty:
+            self._draw()
+
+        # Only the regions that changed since the last render are pushed
+        rects = self.update_rects
+        if self.headless:
+            if self.window is None:
+                self._open_window()
+                rects = None
+            if rects is None:
+                self.window.blit(self.screen, (0, 0))
+            else:
+                for rect in rects:
+                    self.window.blit(self.screen, rect, rect)
+
+        if rects is None:
+            pygame.display.update()
+        else:
+            pygame.display.update(rects)
+        self.update_rects = []
+
+        if self.render_delay:
+            pygame.time.delay(self.render_delay)
 
     def game_loop(self):
         """
@@ -226,24 +578,101 @@ class DuetGame(gym.Env):
         """
         return 3
 
-    def _get_pixel_state(self):
+    def _capture_observation(self, out=None, pool=False, new_episode=False):
+        """
+        Returns the current observation like _get_observation(), max pooled
+        with the pool buffer if pool is True. With frame stacking, the
+        observation is pushed to the frame stack, filling it if new_episode
+        is True, and the stacked observations are returned instead.
+        """
+
+        stack = self.frame_stack
+        if stack is None:
+            state = self._get_observation(out)
+            if pool:
+                np.maximum(state, self.pool_buffer, out=state)
+            return state
+
+        frame = self._get_observation(stack.next_frame())
+        if pool:
+            np.maximum(frame, self.pool_buffer, out=frame)
+        stack.advance(new_episode)
+
+        state = stack.stacked()
+        if out is not None:
+            np.copyto(out, state)
+            return out
+        if self.copy_state:
+            return state.copy()
+        return state
+
+    def _get_observation(self, out=None):
+        """
+        Returns the current observation in the chosen state representation,
+        as returned by step() and reset(). Snapshots of the full game state
+        are taken with get_state() instead.
+
+        The observation is written to out if given, and otherwise to the
+        state buffer, which is copied unless copy_state is False.
         """
-        Returns the current screen as a numpy pixel array.
+
+        state = self.state_buffer if out is None else out
+
+        if self.state_rep == "coord":
+            self._get_coord_state(state)
+        elif self.state_rep == "pixel":
+            self._get_pixel_state(state)
+
+        if out is None and self.copy_state:
+            return state.copy()
+        return state
+
+    def _get_pixel_state(self, out=None):
         """
+        Returns the current screen as a numpy pixel array in the pixel
+        format of the game, written to out if given.
+        """
+        if out is None:
+            out = np.empty(self.pixel_format.shape, dtype=self.pixel_format.dtype)
+
+        if self.pixel_backend == "numpy":
+            return self._rasterize(out)
+
+        if self.frame_dirty:
+            self._draw()
+
         screen_pixels = pygame.PixelArray(self.screen)
         state = np.asarray(screen_pixels).T
         screen_pixels.close()
 
-        # Reshape and convert to RGB
+        # Every drawn pixel becomes white in grey scale, so a single
+        # channel is resized and broadcast to the channels of the state
         img = Image.fromarray(state)
-        state = np.array(img.convert('RGB').resize((84, 84)))
+        height, width = self.pixel_format.size
+        frame = np.asarray(img.convert('L').resize((width, height)))
 
-        return state
+        return self.pixel_format.write(frame, out)
 
-    def _get_coord_state(self):
+    def _rasterize(self, out=None):
+        """
+        Rasterizes the current state of the game into a numpy pixel array
+        in the pixel format of the game, without drawing the screen. The
+        pixel array is written to out if given.
+        """
+        if out is None:
+            out = np.empty(self.pixel_format.shape, dtype=self.pixel_format.dtype)
+
+        ball_positions = (self.blue_ball.position(), self.red_ball.position())
+
+        frame = self.rasterizer.draw_frame(ball_positions, self.obstacle_manager.rects(),
+                                           self.score)
+
+        return self.pixel_format.write(frame, out)
+
+    def _get_coord_state(self, out=None):
         """
         Returns the state of the game as a numpy array of coords
-        of the agent and the obstacles.
+        of the agent and the obstacles, written to out if given.
 
         [blue, red, top_1, bottom_1, right_1, left_1,
         top_2, bottom_2, right_2, left_2]
@@ -252,29 +681,27 @@ class DuetGame(gym.Env):
         is (0, 0, 0, 0) if there is no second obstacle.
         """
 
-        # Get the player coords
-        blue_x, blue_y = self.blue_ball.position()
-        red_x, red_y = self.red_ball.position()
+        if out is None:
+            out = np.empty(COORD_STATE_SHAPE, dtype=np.int64)
 
-        coords = [blue_x, blue_y, red_x, red_y]
+        # Get the player coords
+        out[0], out[1] = self.blue_ball.position()
+        out[2], out[3] = self.red_ball.position()
 
         # Get the closest obstacle
-        current_obstacle_set = self.obstacle_manager.oldest_obstacle_set()
+        manager = self.obstacle_manager
+        oldest = manager.head
+        top = manager.set_top(oldest)
+        bottom = top - manager.height[oldest]
 
-        obs_1 = current_obstacle_set[0]
-        left, right = obs_1.x_span()
-        top, bottom = obs_1.get_top(), obs_1.get_bottom()
-        obs_1_coords = [top, bottom, left, right]
+        out[4], out[5] = top, bottom
+        out[6], out[7] = manager.left[oldest, 0], manager.right[oldest, 0]
 
-        if len(current_obstacle_set) == 1:
-            obs_2_coords = [0, 0, 0, 0]
+        if manager.count[oldest] == 1:
+            out[8:12] = 0
         else:
-            obs_2 = current_obstacle_set[1]
-            left, right = obs_2.x_span()
-            top, bottom = obs_2.get_top(), obs_2.get_bottom()
-            obs_2_coords = [top, bottom, left, right]
-
-        coords = coords + obs_1_coords + obs_2_coords
+            out[8], out[9] = top, bottom
+            out[10], out[11] = manager.left[oldest, 1], manager.right[oldest, 1]
 
         """
         # Get the second closest obstacle
@@ -300,9 +727,170 @@ class DuetGame(gym.Env):
             coords = coords + obs_1_coords + obs_2_coords
 
         """
-        coords = np.array(coords)
 
-        return coords
+        return out
+
+    def _step_frame(self):
+        """
+        Advances the game one frame and returns (scored, collided), where
+        scored tells if an obstacle set left the board and collided if
+        either ball collided with an obstacle.
+        """
+
+        scored = False
+
+        # Move the player balls
+        self._move_balls()
+
+        # Move all obstacles downward
+        self._move_obstacles()
+
+        # If an obstacle went out of frame, delete it
+        if self.obstacle_manager.oldest_out_of_frame():
+            self.obstacle_manager.remove_obstacle_set()
+            self.score += 1
+            scored = True
+
+        # If it is time, make a new obstacle
+        if self.i % NEW_OBS_INTERVAL == 0:
+            self.obstacle_manager.new_obstacle_set()
+
+        # The screen is only redrawn when a frame is actually needed
+        self.frame_dirty = True
+
+        collided = self._collided()
+
+        self.i += 1
+        self.i = self.i % NEW_OBS_INTERVAL
+
+        return scored, collided
+
+    def _collided(self):
+        """
+        Checks if either ball has collided with the oldest obstacle set.
+        """
+        if self.collision_table is not None:
+            manager = self.obstacle_manager
+            return self.collision_table.collided(
+                (self.blue_ball.angle, self.red_ball.angle),
+                manager.obs_type[manager.head], manager.set_top(manager.head))
+
+        for rect in self.obstacle_manager.oldest_rects():
+            if self.blue_ball.collided_with_rect(*rect):
+                return True
+            if self.red_ball.collided_with_rect(*rect):
+                return True
+        return False
+
+    def _skip_frames(self, n_frames):
+        """
+        Advances the game n_frames frames in which the balls are idle and
+        nothing happens, i.e. no obstacle set spawns or leaves the board
+        and no ball collides.
+        """
+        if n_frames > 0:
+            self.obstacle_manager.move_obstacles(n_frames)
+            self.i = (self.i + n_frames) % NEW_OBS_INTERVAL
+            self.frame_dirty = True
+
+    def _frames_to_event(self):
+        """
+        Returns the number of frames until the next frame in which an
+        obstacle set spawns or leaves the board or, if the balls stay idle,
+        a ball collides.
+        """
+
+        # Frames until self.i is a multiple of NEW_OBS_INTERVAL
+        n_frames = (-self.i) % NEW_OBS_INTERVAL + 1
+
+        manager = self.obstacle_manager
+        top = manager.set_top(manager.head)
+
+        # Frames until the oldest obstacle set is out of frame
+        n_frames = min(n_frames, max(1, -((top - BOARD_HEIGHT - 5)//OBS_VEL)))
+
+        # Frames until either ball collides with the oldest obstacle set,
+        # which can only happen while its top is in (y - r - height, y + r)
+        for left, right, _, bottom in manager.oldest_rects():
+            height = bottom - top
+            for ball in (self.blue_ball, self.red_ball):
+                low = ball.y - BALL_RADIUS - height
+                high = ball.y + BALL_RADIUS
+                frame = max(1, (low - top)//OBS_VEL + 1)
+
+                if self.collision == "box":
+                    # The box of an idle ball collides in the first frame of
+                    # the window, if it overlaps the obstacle horizontally
+                    if (frame < n_frames and top + OBS_VEL*frame < high and
+                            ball.x - BALL_RADIUS < right and left < ball.x + BALL_RADIUS):
+                        n_frames = frame
+                    continue
+
+                # A circle can pass a corner of the obstacle at the start of
+                # the window and only hit it later, so the window is scanned
+                while frame < n_frames and top + OBS_VEL*frame < high:
+                    obs_top = top + OBS_VEL*frame
+                    if ball.collided_with_rect(left, right, obs_top, obs_top + height):
+                        n_frames = frame
+                        break
+                    frame += 1
+
+        return n_frames
+
+    def _new_obstacle_manager(self):
+        """
+        Resets the obstacle manager for a new episode, with its first
+        obstacle set.
+        """
+        self._create_obstacle_manager(self.episode)
+        self.episode += 1
+
+        self.obstacle_manager.new_obstacle_set()
+
+    def _create_obstacle_manager(self, episode):
+        """
+        Empties the obstacle manager for episode number episode.
+        """
+        seed = episode_seed(self.obstacle_seed, self.seed_index, episode)
+
+        self.obstacle_manager.reset(seed)
+        self.obstacle_episode = episode
+
+    def _init_screen(self, headless):
+        """
+        Sets up the surface the game is drawn to, which is the window, or
+        an offscreen surface if headless is True.
+        """
+
+        self.headless = headless
+        if headless:
+            # The display is shared by all games in the process, so it is
+            # left open for them and only this game stops drawing to it
+            self.window = None
+            self.screen = pygame.Surface((BOARD_WIDTH, BOARD_HEIGHT))
+        else:
+            if self.window is None:
+                self._open_window()
+            self.screen = self.window
+
+        self.background = self._draw_background()
+
+        # Rects of the objects on the screen, None if it must be redrawn
+        self.drawn_rects = None
+        # Regions changed since the last render(), None for all of them
+        self.update_rects = None
+        self.frame_dirty = True
+
+    def _open_window(self):
+        """
+        Opens the game window, or reuses the display if another game in the
+        process already opened it, since setting the mode again clears it.
+        """
+        pygame.display.init()
+        self.window = pygame.display.get_surface()
+        if self.window is None:
+            self.window = pygame.display.set_mode((BOARD_WIDTH, BOARD_HEIGHT))
+            pygame.display.set_caption("Duet Game")
 
     def _init_balls(self, draw_rects):
         """
@@ -314,18 +902,21 @@ class DuetGame(gym.Env):
         blue_y = BOARD_HEIGHT - DIST_TO_BOTTOM
         blue_theta = np.pi
         self.blue_ball = Ball(blue_x, blue_y, blue_theta,
-                              CIRCLE_RADIUS, SPIN_STEP, draw_rects)
+                              CIRCLE_RADIUS, SPIN_STEP, draw_rects,
+                              self.collision)
 
         # Create red ball
         red_x = BOARD_WIDTH//2 + CIRCLE_RADIUS
         red_y = BOARD_HEIGHT - DIST_TO_BOTTOM
         red_theta = 0
         self.red_ball = Ball(red_x, red_y, red_theta,
-                             CIRCLE_RADIUS, SPIN_STEP, draw_rects)
+                             CIRCLE_RADIUS, SPIN_STEP, draw_rects,
+                             self.collision)
 
     def _move_balls(self):
         """
-        Applies controlls to the player balls.
+        Applies controlls to the player balls. In manual and controller
+        mode, the action taken is stored in self.action.
         """
 
         if self.mode == "man":
@@ -334,10 +925,15 @@ class DuetGame(gym.Env):
             if keys[pygame.K_LEFT]:
                 self.blue_ball.spin_left()
                 self.red_ball.spin_left()
+                self.action = 1
 
             elif keys[pygame.K_RIGHT]:
                 self.blue_ball.spin_right()
                 self.red_ball.spin_right()
+                self.action = 2
+
+            else:
+                self.action = 0
 
         elif self.mode == "contr":
 
@@ -346,9 +942,13 @@ class DuetGame(gym.Env):
             if controll == -1:
                 self.blue_ball.spin_left()
                 self.red_ball.spin_left()
+                self.action = 1
             elif controll == 1:
                 self.blue_ball.spin_right()
                 self.red_ball.spin_right()
+                self.action = 2
+            else:
+                self.action = 0
 
         elif self.mode == "ai":
 
@@ -361,44 +961,85 @@ class DuetGame(gym.Env):
         else:
             raise ValueError("Invalid game mode '{}'".format(self.mode))
 
-    def _draw_circle(self):
+    def _draw(self):
+        """
+        Draws the current frame of the game to the screen.
+
+        Only the regions covered by the objects of the last frame are
+        restored from the background before the objects are drawn again,
+        unless the whole screen has to be redrawn.
+        """
+
+        if self.drawn_rects is None:
+            self.screen.blit(self.background, (0, 0))
+        else:
+            for rect in self.drawn_rects:
+                self.screen.blit(self.background, rect, rect)
+
+        rects = self._draw_balls() + self._draw_obstacles()
+        rects.append(self._draw_score())
+
+        self._mark_updated(rects if self.drawn_rects is None else self.drawn_rects + rects,
+                           full=self.drawn_rects is None)
+        self.drawn_rects = rects
+
+        self.frame_dirty = False
+
+    def _mark_updated(self, rects, full=False):
         """
-        Draws the gray circle.
+        Adds rects to the regions of the screen that changed since the last
+        render(), or marks the whole screen as changed if full is True or
+        there are too many regions.
         """
-        pygame.draw.circle(self.screen, GREY,
+        if self.update_rects is None:
+            return
+        if full or len(self.update_rects) + len(rects) > MAX_UPDATE_RECTS:
+            self.update_rects = None
+        else:
+            self.update_rects += rects
+
+    def _draw_background(self):
+        """
+        Returns the static background, the gray circle on black, as a
+        surface.
+        """
+        background = pygame.Surface((BOARD_WIDTH, BOARD_HEIGHT))
+        background.fill(BLACK)
+        pygame.draw.circle(background, GREY,
                            (BOARD_WIDTH//2, BOARD_HEIGHT - DIST_TO_BOTTOM),
                            CIRCLE_RADIUS, CIRCLE_WIDTH)
+        return background
 
     def _draw_balls(self):
         """
-        Draws the player balls.
+        Draws the player balls and returns the list of their Rects.
         """
-        self.blue_ball.draw(self.screen, BLUE)
-        self.red_ball.draw(self.screen, RED)
+        return [self.blue_ball.draw(self.screen, BLUE),
+                self.red_ball.draw(self.screen, RED)]
 
     def _draw_obstacles(self):
         """
-        Draws all the current obstacles.
+        Draws all the current obstacles and returns the list of their Rects.
         """
-        for obstacle_set in self.obstacle_manager:
-            for obstacle in obstacle_set:
-                pygame.draw.rect(self.screen, WHITE, obstacle.get_rect())
+        return [pygame.draw.rect(self.screen, WHITE, (left, top, right - left, bottom - top))
+                for left, right, top, bottom in self.obstacle_manager.rects()]
 
     def _draw_score(self):
         """
-        Draws the score in lower left corner.
+        Draws the score in lower left corner and returns its Rect. The
+        rendered score is cached per score value.
         """
-        score_surface = self.score_font.render(str(self.score), False, WHITE)
-        self.screen.blit(score_surface, (10, BOARD_HEIGHT-25))
+        score_surface = self.score_surfaces.get(self.score)
+        if score_surface is None:
+            score_surface = self.score_font.render(str(self.score), False, WHITE)
+            self.score_surfaces[self.score] = score_surface
+        return self.screen.blit(score_surface, (10, BOARD_HEIGHT-25))
 
     def _move_obstacles(self):
         """
         Moves all obstacles one step.
         """
-
-        for obstacle_set in self.obstacle_manager:
-            for obstacle in obstacle_set:
-                obstacle.move()
+        self.obstacle_manager.move_obstacles()
 
     def _game_over(self):
         """
@@ -406,9 +1047,14 @@ class DuetGame(gym.Env):
         """
 
         game_over_surface = self.game_over_font.render("Game Over", False, RED)
-        self.screen.blit(game_over_surface, (50, BOARD_HEIGHT//2))
         restart_surface = self.restart_font.render("Press ESC to quit or RETURN to restart", False, RED)
-        self.screen.blit(restart_surface, (80, BOARD_HEIGHT//2 + 80))
+        rects = [self.screen.blit(game_over_surface, (50, BOARD_HEIGHT//2)),
+                 self.screen.blit(restart_surface, (80, BOARD_HEIGHT//2 + 80))]
+
+        # The messages are restored from the background by the next draw
+        if self.drawn_rects is not None:
+            self.drawn_rects += rects
+        self._mark_updated(rects)
         self.render()
 
         quit_game = False
@@ -0,0 +1,262 @@
+import json
+
+import numpy as np
+
+from gym.envs.duet.duet_env import DuetGame
+from gym.envs.duet.duet_backend.obstacle_manager import ObstacleTape
+
+# man_init() arguments that are overridden when replaying
+REPLAY_CONFIG = {"mode": "ai", "headless": True, "visualize": False, "profile": False}
+
+
+class EpisodeRecorder(object):
+    """
+    Records the episodes of a DuetGame compactly, for replaying them with
+    EpisodeReplayer.
+
+    A game is deterministic given its man_init() arguments, the seed of the
+    obstacles of an episode and the actions taken, so only these are
+    recorded, at one byte per step. States are regenerated when replaying.
+
+    The recorder attaches itself to game, and records every episode from
+    its reset on. Games in controller mode can only be recorded with
+    n_repeat_action=1 and step(), since the controller picks an action
+    every frame.
+    """
+
+    def __init__(self, game):
+
+        if game.mode not in ("ai", "contr"):
+            raise ValueError("Cannot record games in mode '{}'".format(game.mode))
+        if game.mode == "contr" and game.n_repeat_action != 1:
+            raise ValueError("Controller games can only be recorded with n_repeat_action=1")
+
+        self.game = game
+        self.config = dict(game.config)
+        self.tape = game.tape
+
+        # One entry per episode
+        self.seeds = []
+        self.indices = []
+        self.episodes = []
+        self.starts = []
+        self.scores = []
+
+        # One entry per step, frames is -1 for step() and the number of
+        # frames for step_until()
+        self.actions = bytearray()
+        self.frames = []
+
+        game.attach(self)
+
+    def __len__(self):
+
+        return len(self.starts)
+
+    def on_reset(self, game, state):
+        """
+        Starts recording a new episode.
+        """
+        self.seeds.append(game.obstacle_seed)
+        self.indices.append(game.seed_index)
+        self.episodes.append(game.obstacle_episode)
+        self.starts.append(len(self.actions))
+        self.scores.append(0)
+
+    def on_step(self, game, state, reward, game_over, info):
+        """
+        Records the action of a step.
+        """
+        if not self.starts:
+            raise RuntimeError("The game must be reset before it is recorded")
+        if game.mode == "contr" and "frames" in info:
+            raise ValueError("step_until() cannot be recorded in controller mode")
+
+        self.actions.append(game.action if game.action in (1, 2) else 0)
+        self.frames.append(info.get("frames", -1))
+        self.scores[-1] = game.score
+
+    def close(self):
+        """
+        Stops recording.
+        """
+        self.game.detach(self)
+
+    def save(self, path):
+        """
+        Saves the recorded episodes to path as a .npz file.
+        """
+
+        arrays = {
+            "config": np.array(json.dumps(json_config(self.config))),
+            "seeds": np.array(self.seeds, dtype=np.uint64),
+            "indices": np.array(self.indices, dtype=np.int64),
+            "episodes": np.array(self.episodes, dtype=np.int64),
+            "starts": np.array(self.starts, dtype=np.int64),
+            "scores": np.array(self.scores, dtype=np.int64),
+            "actions": np.frombuffer(bytes(self.actions), dtype=np.uint8),
+        }
+        if any(frames >= 0 for frames in self.frames):
+            arrays["frames"] = np.array(self.frames, dtype=np.int32)
+        if self.tape is not None:
+            arrays.update(tape_obs_type=self.tape.obs_type, tape_count=self.tape.count,
+                          tape_left=self.tape.left, tape_width=self.tape.width,
+                          tape_height=self.tape.height)
+
+        np.savez_compressed(path, **arrays)
+
+
+class EpisodeReplayer(object):
+    """
+    Replays episodes saved by EpisodeRecorder in headless games.
+
+    Replays use the recorded man_init() arguments, but any of them can be
+    overridden, for instance to regenerate pixel states of an episode that
+    was recorded with coord states.
+    """
+
+    def __init__(self, path):
+
+        with np.load(path) as data:
+            self.config = json.loads(str(data["config"]))
+            self.seeds = data["seeds"]
+            self.indices = data["indices"]
+            self.episodes = data["episodes"]
+            self.starts = data["starts"]
+            self.scores = data["scores"]
+            self.actions = data["actions"]
+            self.frames = data["frames"] if "frames" in data else None
+
+            self.tape = None
+            if "tape_obs_type" in data:
+                self.tape = ObstacleTape(data["tape_obs_type"], data["tape_count"],
+                                         data["tape_left"], data["tape_width"],
+                                         data["tape_height"])
+
+        self.ends = np.append(self.starts[1:], len(self.actions)).astype(np.int64)
+
+    def __len__(self):
+
+        return len(self.starts)
+
+    def episode_length(self, n):
+        """
+        Returns the number of steps of episode n.
+        """
+        return int(self.ends[n] - self.starts[n])
+
+    def make_game(self, **overrides):
+        """
+        Returns a headless game initialized like the recorded one, with the
+        man_init() arguments in overrides replaced.
+        """
+        config = dict(self.config, tape=self.tape)
+        config.update(REPLAY_CONFIG)
+        config.update(overrides)
+
+        game = DuetGame(headless=True)
+        game.man_init(**config)
+
+        return game
+
+    def replay(self, n, game=None, **overrides):
+        """
+        Replays episode n and yields (state, reward, game_over) for its
+        first state and after every step. The game is made by make_game()
+        with overrides, unless given.
+        """
+
+        if game is None:
+            game = self.make_game(**overrides)
+
+        yield self._reset(n, game), 0, False
+
+        for t in range(self.episode_length(n)):
+            yield self._step(n, game, t)
+
+    def states(self, n, **overrides):
+        """
+        Returns all states of episode n, its first state included, stacked
+        in one array.
+        """
+        overrides.setdefault("copy_state", True)
+        return np.stack([state for state, _, _ in self.replay(n, **overrides)])
+
+    def state(self, n, t, **overrides):
+        """
+        Returns the state of episode n after t steps. Only the states needed
+        for it are generated.
+        """
+
+        game = self.make_game(**overrides)
+
+        # Frame stacks need the states before the last one as well
+        n_frames = game.frame_stack.n_frames if game.frame_stack is not None else 1
+        first_captured = t - n_frames + 1
+
+        game.capture = first_captured <= 0
+        state = self._reset(n, game)
+        for step in range(t):
+            game.capture = step + 1 >= first_captured
+            state, _, _ = self._step(n, game, step)
+
+        return state
+
+    def final_score(self, n):
+        """
+        Replays episode n without generating any states and returns its
+        final score.
+        """
+
+        game = self.make_game(state_rep="coord", capture=False, frame_stack=1, max_pool=False)
+
+        self._reset(n, game)
+        for t in range(self.episode_length(n)):
+            self._step(n, game, t)
+
+        return game.score
+
+    def verify(self, n):
+        """
+        Checks that replaying episode n gives its recorded final score.
+        """
+        return self.final_score(n) == self.scores[n]
+
+    def _reset(self, n, game):
+        """
+        Resets game to the start of episode n and returns its first state.
+        """
+        game.seed(int(self.seeds[n]), int(self.indices[n]))
+        game.episode = int(self.episodes[n])
+
+        return game.reset()
+
+    def _step(self, n, game, t):
+        """
+        Performs step t of episode n in game and returns (state, reward,
+        game_over).
+        """
+        step = self.starts[n] + t
+        action = int(self.actions[step])
+        frames = int(self.frames[step]) if self.frames is not None else -1
+
+        if frames >= 0:
+            state, reward, game_over, _ = game.step_until(action, frames)
+        else:
+            state, reward, game_over, _ = game.step(action)
+
+        return state, reward, game_over
+
+
+def json_config(config):
+    """
+    Returns the man_init() arguments in config in a form that can be
+    saved as JSON, without the tape.
+    """
+    config = dict(config, tape=None)
+    config["pixel_dtype"] = np.dtype(config["pixel_dtype"]).str
+    config["pixel_size"] = [int(n) for n in config["pixel_size"]]
+    for name, value in config.items():
+        if isinstance(value, np.generic):
+            config[name] = value.item()
+    return config
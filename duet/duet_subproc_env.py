@@ -0,0 +1,281 @@
+import ctypes
+import multiprocessing
+import random
+import traceback
+
+import numpy as np
+from gym import spaces
+
+from gym.envs.duet.duet_env import DuetGame, BOARD_HEIGHT, COORD_STATE_SHAPE
+from gym.envs.duet.duet_backend.pixel_format import PixelFormat
+
+PIXEL_FORMAT_ARGS = ("pixel_size", "grayscale", "channels_first", "pixel_dtype")
+
+
+def _pixel_format(man_init_kwargs):
+    """
+    Returns the PixelFormat of a game initialized with man_init_kwargs.
+    """
+    return PixelFormat(**{arg: man_init_kwargs[arg] for arg in PIXEL_FORMAT_ARGS
+                          if arg in man_init_kwargs})
+
+
+def _state_spec(man_init_kwargs):
+    """
+    Returns the (shape, dtype) of a single state of a game initialized
+    with man_init_kwargs, stacked if frame_stack is given.
+    """
+    state_rep = man_init_kwargs.get("state_rep", "pixel")
+    channel_axis = -1
+    if state_rep == "pixel":
+        pixel_format = _pixel_format(man_init_kwargs)
+        shape, dtype = pixel_format.shape, pixel_format.dtype
+        if pixel_format.channels_first:
+            channel_axis = 0
+    elif state_rep == "coord":
+        shape, dtype = COORD_STATE_SHAPE, np.dtype(np.int64)
+    else:
+        raise ValueError("Invalid state representation '{}'".format(state_rep))
+
+    n_frames = man_init_kwargs.get("frame_stack", 1)
+    if n_frames > 1:
+        shape = list(shape)
+        shape[channel_axis] *= n_frames
+        shape = tuple(shape)
+
+    return shape, dtype
+
+
+def _shared_states(shared_block, num_envs, shape, dtype):
+    """
+    Returns the two halves of states of all games as a numpy array backed
+    by shared_block, of shape (2, num_envs) + shape.
+    """
+    return np.frombuffer(shared_block, dtype=dtype).reshape((2, num_envs) + shape)
+
+
+def _worker(remote, parent_remote, index, shared_block, num_envs, man_init_kwargs):
+    """
+    Runs one DuetGame and serves commands sent through remote, writing the
+    states of the game to row index of the half of the shared state array
+    given with the command.
+
+    Every reply is (True, result), or (False, traceback) if the command
+    failed, after which the worker stops. A reply is sent once the game is
+    initialized.
+    """
+
+    parent_remote.close()
+
+    try:
+        game = DuetGame(headless=man_init_kwargs["headless"])
+        game.man_init(**man_init_kwargs)
+
+        shape, dtype = _state_spec(man_init_kwargs)
+        states = _shared_states(shared_block, num_envs, shape, dtype)[:, index]
+        remote.send((True, None))
+
+        while True:
+            cmd, data = remote.recv()
+
+            if cmd == "step":
+                action, half = data
+                _, reward, game_over, _ = game.step(action, out=states[half])
+                if game_over:
+                    game.reset(out=states[half])
+                remote.send((True, (reward, game_over)))
+
+            elif cmd == "seed":
+                game.seed(*data)
+                remote.send((True, None))
+
+            elif cmd == "reset":
+                game.reset(out=states[data])
+                remote.send((True, None))
+
+            elif cmd == "close":
+                break
+
+            else:
+                raise ValueError("Invalid command '{}'".format(cmd))
+
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        remote.send((False, traceback.format_exc()))
+    finally:
+        remote.close()
+
+
+class DuetSubprocVecEnv(object):
+    """
+    A pool of num_envs DuetGame instances, each running in its own process.
+
+    The workers write their states straight into one shared memory block,
+    so only actions, rewards and game overs are sent through pipes. Steps
+    can be split into step_async() and step_wait() to overlap simulation
+    with other work, such as inference on the previous states.
+
+    The shared block holds two halves of states, and every reset or step
+    writes to the other half than the one before. With copy_state=False
+    the states returned are a view of the shared block, which therefore
+    stays unchanged while the next step runs, and is only overwritten by
+    the step after it.
+
+    All keyword arguments are passed on to DuetGame.man_init() in every
+    worker, and the games are headless unless headless=False is passed.
+    Games that end are reset, and their row of states holds the first
+    state of the new game. If a worker fails, the call waiting for it
+    raises a RuntimeError with the traceback of the worker.
+    """
+
+    def __init__(self, num_envs, start_method=None, copy_state=True, **man_init_kwargs):
+
+        self.num_envs = num_envs
+        self.copy_state = copy_state
+
+        man_init_kwargs.setdefault("state_rep", "pixel")
+        man_init_kwargs["capture"] = True
+        man_init_kwargs.setdefault("headless", True)
+        shape, dtype = _state_spec(man_init_kwargs)
+
+        self.action_space = spaces.Discrete(3)
+        if man_init_kwargs["state_rep"] == "pixel":
+            self.observation_space = spaces.Box(low=0, high=_pixel_format(man_init_kwargs).high,
+                                                shape=shape, dtype=dtype)
+        else:
+            self.observation_space = spaces.Box(low=0, high=BOARD_HEIGHT, shape=shape, dtype=np.uint8)
+
+        ctx = multiprocessing.get_context(start_method)
+
+        nbytes = 2*num_envs*int(np.prod(shape))*dtype.itemsize
+        self.shared_block = ctx.RawArray(ctypes.c_byte, nbytes)
+        self.states = _shared_states(self.shared_block, num_envs, shape, dtype)
+        # Half of the shared states written by the last reset or step
+        self.half = 1
+
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(num_envs)])
+        self.processes = []
+        for index, (work_remote, remote) in enumerate(zip(self.work_remotes, self.remotes)):
+            args = (work_remote, remote, index, self.shared_block, num_envs, man_init_kwargs)
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.waiting = False
+        self.closed = False
+
+        try:
+            self._recv_all()
+        except RuntimeError:
+            self.close()
+            raise
+
+    def seed(self, seed=None):
+        """
+        Seeds the obstacle generators of all games, like DuetGame.seed()
+        with the index of each game as its env index.
+        """
+        if seed is None:
+            seed = random.SystemRandom().randrange(2**63)
+
+        for index, remote in enumerate(self.remotes):
+            remote.send(("seed", (seed, index)))
+        self._recv_all()
+
+        return [seed]
+
+    def reset(self):
+        """
+        Resets all games and returns their states.
+        """
+        self.half = 1 - self.half
+        for remote in self.remotes:
+            remote.send(("reset", self.half))
+        self._recv_all()
+
+        return self._get_states()
+
+    def step_async(self, actions):
+        """
+        Sends one action per game to the workers without waiting for them.
+        """
+        self.half = 1 - self.half
+        for remote, action in zip(self.remotes, actions):
+            remote.send(("step", (int(action), self.half)))
+        self.waiting = True
+
+    def step_wait(self):
+        """
+        Waits for the steps sent by step_async() and returns (states,
+        rewards, game_overs) as arrays with one row per game.
+        """
+        try:
+            results = self._recv_all()
+        finally:
+            self.waiting = False
+
+        rewards, game_overs = zip(*results)
+
+        return (self._get_states(), np.array(rewards, dtype=np.int64),
+                np.array(game_overs, dtype=bool))
+
+    def step(self, actions):
+        """
+        Performs one action per game and returns (states, rewards, game_overs).
+        """
+        self.step_async(actions)
+
+        return self.step_wait()
+
+    def close(self):
+        """
+        Stops all worker processes.
+        """
+        if self.closed:
+            return
+        for remote in self.remotes:
+            try:
+                if self.waiting:
+                    remote.recv()
+                remote.send(("close", None))
+            except (EOFError, OSError):
+                # The worker has already stopped
+                pass
+        for process in self.processes:
+            process.join()
+        self.waiting = False
+        self.closed = True
+
+    def _recv_all(self):
+        """
+        Receives the reply of every worker and returns their results.
+        Raises a RuntimeError if any worker failed.
+        """
+
+        results = []
+        errors = []
+        for index, remote in enumerate(self.remotes):
+            try:
+                ok, result = remote.recv()
+            except EOFError:
+                ok, result = False, "The worker process exited\n"
+            if ok:
+                results.append(result)
+            else:
+                errors.append("Worker {} failed:\n{}".format(index, result))
+
+        if errors:
+            raise RuntimeError("".join(errors))
+
+        return results
+
+    def _get_states(self):
+        """
+        Returns the half of the shared state array written last, or a copy
+        of it if copy_state is True.
+        """
+        if self.copy_state:
+            return self.states[self.half].copy()
+        return self.states[self.half]
@@ -0,0 +1,391 @@
+import random
+
+import numpy as np
+from gym import spaces
+
+from gym.envs.duet.duet_env import (BOARD_HEIGHT, BOARD_WIDTH, CIRCLE_RADIUS,
+                                    DIST_TO_BOTTOM, SPIN_STEP, NEW_OBS_INTERVAL,
+                                    COORD_STATE_SHAPE)
+from gym.envs.duet.duet_backend.ball import BALL_RADIUS, n_spin_angles, spin_offsets
+from gym.envs.duet.duet_backend.collision import get_collision_function
+from gym.envs.duet.duet_backend.collision_table import get_collision_table
+from gym.envs.duet.duet_backend.obstacle_manager import (OBS_VEL, SPAWN_HEIGHT,
+                                                         MAX_OBSTACLE_SETS,
+                                                         episode_seed,
+                                                         generate_obstacle_set)
+from gym.envs.duet.duet_backend.frame_stack import FrameStack
+from gym.envs.duet.duet_backend.pixel_format import PixelFormat
+from gym.envs.duet.duet_backend.rasterizer import Rasterizer
+
+CIRCLE_X = BOARD_WIDTH//2
+CIRCLE_Y = BOARD_HEIGHT - DIST_TO_BOTTOM
+
+N_ANGLES = n_spin_angles(SPIN_STEP)
+X_OFFSETS, Y_OFFSETS = spin_offsets(CIRCLE_RADIUS, N_ANGLES)
+
+
+class DuetVecEnv(object):
+    """
+    A batch of num_envs Duet games that are stepped together.
+
+    The state of all games (ball angles, obstacle coordinates and spawn
+    counters) is kept in numpy arrays with one row per game, so a step
+    costs about as much as a single DuetGame.step() regardless of the
+    number of games.
+    """
+
+    def __init__(self, num_envs, state_rep="coord", n_repeat_action=1,
+                 random_obstacles=True, collision="box", copy_state=True, tape=None,
+                 collision_table=False, pixel_size=(84, 84), grayscale=False,
+                 channels_first=False, pixel_dtype=np.uint8, frame_stack=1):
+        """
+        States are written to a buffer that is allocated once. If
+        copy_state is False, step() and reset() return that buffer itself,
+        which is overwritten by the next call, instead of a copy of it.
+
+        If tape is given, all games read their obstacle sets from that
+        ObstacleTape, so they all face the same obstacles.
+
+        If collision_table is True, collisions are gathered from a
+        precomputed CollisionTable instead of being tested geometrically,
+        like in DuetGame.man_init().
+
+        pixel_size, grayscale, channels_first and pixel_dtype set the
+        format of pixel states, see PixelFormat.
+
+        With frame_stack > 1, states are the last frame_stack states of
+        every game stacked along the channel axis, kept in a FrameStack
+        like in DuetGame.man_init(). Games that are reset start with a
+        stack filled with their first state.
+        """
+
+        self.pixel_format = PixelFormat(pixel_size, grayscale, channels_first, pixel_dtype)
+        if state_rep == "pixel":
+            self.rasterizer = Rasterizer(self.pixel_format.size)
+            self.observation_space = self.pixel_format.space()
+            self.state_buffer = np.zeros((num_envs,) + self.pixel_format.shape,
+                                         dtype=self.pixel_format.dtype)
+        elif state_rep == "coord":
+            self.observation_space = spaces.Box(low=0, high=BOARD_HEIGHT, shape=COORD_STATE_SHAPE, dtype=np.uint8)
+            self.state_buffer = np.zeros((num_envs,) + COORD_STATE_SHAPE, dtype=np.int64)
+        else:
+            raise ValueError("Invalid state representation '{}'".format(state_rep))
+        self.copy_state = copy_state
+
+        self.frame_stack = None
+        if frame_stack > 1:
+            channel_axis = 0 if state_rep == "pixel" and channels_first else -1
+            self.frame_stack = FrameStack(frame_stack, self.state_buffer.shape[1:],
+                                          self.state_buffer.dtype, channel_axis, (num_envs,))
+            space = self.observation_space
+            self.observation_space = spaces.Box(low=0, high=space.high.flat[0],
+                                                shape=self.frame_stack.stacked_shape[1:],
+                                                dtype=space.dtype)
+
+        self.num_envs = num_envs
+        self.state_rep = state_rep
+        self.n_repeat_action = n_repeat_action
+        self.random_obstacles = random_obstacles
+        self.collides = get_collision_function(collision, vectorized=True)
+
+        self.collision_table = None
+        if collision_table:
+            cache_path = collision_table if isinstance(collision_table, str) else None
+            self.collision_table = get_collision_table(
+                collision, N_ANGLES, (CIRCLE_X, CIRCLE_Y), CIRCLE_RADIUS, cache_path)
+            if tape is not None and not self.collision_table.matches(tape):
+                raise ValueError("Tape holds obstacle sets the collision table does not cover")
+
+        self.action_space = spaces.Discrete(3)
+
+        self.env_idx = np.arange(num_envs)
+
+        # Player balls, column 0 is the blue ball and column 1 the red ball.
+        # Angles are indices into X_OFFSETS and Y_OFFSETS.
+        self.angle = np.zeros((num_envs, 2), dtype=np.int64)
+        self.ball_x = np.zeros((num_envs, 2), dtype=np.int64)
+        self.ball_y = np.zeros((num_envs, 2), dtype=np.int64)
+
+        # Ring buffer of obstacle sets per game, oldest set at self.head
+        self.obs_type = np.zeros((num_envs, MAX_OBSTACLE_SETS), dtype=np.int8)
+        self.obs_count = np.zeros((num_envs, MAX_OBSTACLE_SETS), dtype=np.int64)
+        self.obs_top = np.zeros((num_envs, MAX_OBSTACLE_SETS), dtype=np.int64)
+        self.obs_height = np.zeros((num_envs, MAX_OBSTACLE_SETS), dtype=np.int64)
+        self.obs_left = np.zeros((num_envs, MAX_OBSTACLE_SETS, 2), dtype=np.int64)
+        self.obs_right = np.zeros((num_envs, MAX_OBSTACLE_SETS, 2), dtype=np.int64)
+        self.head = np.zeros(num_envs, dtype=np.int64)
+        self.size = np.zeros(num_envs, dtype=np.int64)
+
+        self.i = np.ones(num_envs, dtype=np.int64)
+        self.score = np.zeros(num_envs, dtype=np.int64)
+
+        self.tape = tape
+        self.cursor = np.zeros(num_envs, dtype=np.int64)
+        self.rngs = [random.Random() for _ in range(num_envs)]
+        self.episodes = np.zeros(num_envs, dtype=np.int64)
+        self.seed()
+
+    def seed(self, seed=None):
+        """
+        Seeds the obstacle generators of all games, like DuetGame.seed()
+        with the index of each game as its env index.
+        """
+        if seed is None:
+            seed = random.SystemRandom().randrange(2**63)
+
+        self.obstacle_seed = seed
+        self.episodes[:] = 0
+
+        return [seed]
+
+    def reset(self, out=None):
+        """
+        Resets all games and returns their states, written to out if given.
+        """
+        new_episode = np.ones(self.num_envs, dtype=bool)
+        self._reset_envs(new_episode)
+
+        return self._get_state(out, new_episode)
+
+    def step(self, actions, out=None):
+        """
+        Performs one action per game and returns (states, rewards, game_overs)
+        as arrays with one row per game. If out is given, the states are
+        written to it and out is returned as states.
+
+        Games that end are reset, and their row of states holds the first
+        state of the new game.
+        """
+
+        actions = np.asarray(actions)
+        spin = np.where(actions == 1, -1, np.where(actions == 2, 1, 0))[:, None]
+
+        reward = np.zeros(self.num_envs, dtype=np.int64)
+        game_over = np.zeros(self.num_envs, dtype=bool)
+
+        for _ in range(self.n_repeat_action):
+
+            # Move the player balls
+            self._move_balls(spin)
+
+            # Move all obstacles downward
+            self.obs_top += OBS_VEL
+
+            # If an obstacle set went out of frame, delete it
+            out_of_frame = self._oldest(self.obs_top) - 5 >= BOARD_HEIGHT
+            if out_of_frame.any():
+                self.head[out_of_frame] = (self.head[out_of_frame] + 1) % MAX_OBSTACLE_SETS
+                self.size[out_of_frame] -= 1
+                self.score += out_of_frame
+                reward[out_of_frame] = 1
+
+            # If it is time, make new obstacles
+            new_obs = self.i % NEW_OBS_INTERVAL == 0
+            if new_obs.any():
+                self._new_obstacle_sets(np.flatnonzero(new_obs))
+
+            # If either ball has collided, the game is over
+            collided = self._collided()
+            reward[collided] = 0
+            game_over |= collided
+
+            self.i = (self.i + 1) % NEW_OBS_INTERVAL
+
+        if game_over.any():
+            self._reset_envs(game_over)
+
+        return self._get_state(out, game_over), reward, game_over
+
+    def _reset_envs(self, mask):
+        """
+        Resets the games selected by the boolean array mask.
+        """
+
+        self.angle[mask] = (N_ANGLES//2, 0)
+        self.ball_x[mask] = (CIRCLE_X - CIRCLE_RADIUS, CIRCLE_X + CIRCLE_RADIUS)
+        self.ball_y[mask] = CIRCLE_Y
+
+        self.head[mask] = 0
+        self.size[mask] = 0
+
+        self.i[mask] = 1
+        self.score[mask] = 0
+        self.cursor[mask] = 0
+
+        envs = np.flatnonzero(mask)
+        if self.tape is None:
+            for env in envs:
+                if self.random_obstacles:
+                    self.rngs[env].seed(episode_seed(self.obstacle_seed, env, self.episodes[env]))
+                    self.episodes[env] += 1
+                else:
+                    self.rngs[env].seed(221)  # for deterministic sequence
+        self._new_obstacle_sets(envs)
+
+    def _move_balls(self, spin):
+        """
+        Spins the player balls of every game by its angle step in spin.
+        """
+
+        self.angle += spin
+        self.angle %= N_ANGLES
+
+        self.ball_x = CIRCLE_X + X_OFFSETS[self.angle]
+        self.ball_y = CIRCLE_Y + Y_OFFSETS[self.angle]
+
+    def _new_obstacle_sets(self, envs):
+        """
+        Adds a new obstacle set to each game in the array envs.
+        """
+
+        if self.tape is None:
+            for env in envs:
+                self._new_obstacle_set(env)
+            return
+
+        tape = self.tape
+        rows = self.cursor[envs] % len(tape)
+        self.cursor[envs] += 1
+
+        slots = (self.head[envs] + self.size[envs]) % MAX_OBSTACLE_SETS
+        self.obs_type[envs, slots] = tape.obs_type[rows]
+        self.obs_count[envs, slots] = tape.count[rows]
+        self.obs_top[envs, slots] = SPAWN_HEIGHT - tape.height[rows]
+        self.obs_height[envs, slots] = tape.height[rows]
+        self.obs_left[envs, slots] = tape.left[rows]
+        self.obs_right[envs, slots] = tape.left[rows] + tape.width[rows, None]
+
+        self.size[envs] += 1
+
+    def _new_obstacle_set(self, env):
+        """
+        Generates a new obstacle set in game env.
+        """
+
+        obs_type, spawn_xs, width, height = generate_obstacle_set(self.rngs[env])
+
+        slot = (self.head[env] + self.size[env]) % MAX_OBSTACLE_SETS
+        self.obs_type[env, slot] = obs_type.value
+        self.obs_count[env, slot] = len(spawn_xs)
+        self.obs_top[env, slot] = SPAWN_HEIGHT - height
+        self.obs_height[env, slot] = height
+        for k, spawn_x in enumerate(spawn_xs):
+            self.obs_left[env, slot, k] = spawn_x
+            self.obs_right[env, slot, k] = spawn_x + width
+
+        self.size[env] += 1
+
+    def _oldest(self, array):
+        """
+        Returns the rows of array that belong to the oldest obstacle set
+        of every game.
+        """
+        return array[self.env_idx, self.head]
+
+    def _collided(self):
+        """
+        Checks, for every game, if either ball has collided with the
+        oldest obstacle set.
+        """
+
+        if self.collision_table is not None:
+            obs_type = self._oldest(self.obs_type)[:, None]
+            top = self._oldest(self.obs_top)[:, None]
+            hits = self.collision_table.lookup(self.angle, obs_type, top)
+            return hits.any(axis=1)
+
+        top = self._oldest(self.obs_top)[:, None, None]
+        bottom = top + self._oldest(self.obs_height)[:, None, None]
+        left = self._oldest(self.obs_left)[:, None, :]
+        right = self._oldest(self.obs_right)[:, None, :]
+        present = (np.arange(2) < self._oldest(self.obs_count)[:, None])[:, None, :]
+
+        collided = self.collides(self.ball_x[:, :, None], self.ball_y[:, :, None],
+                                 BALL_RADIUS, left, right, top, bottom)
+
+        return (collided & present).any(axis=(1, 2))
+
+    def _get_state(self, out=None, new_episode=None):
+        """
+        Returns the states of all games in the chosen state representation.
+
+        The states are written to out if given, and otherwise to the state
+        buffer, which is copied unless copy_state is False. With frame
+        stacking, the states are pushed to the frame stack, filling the
+        stacks of the games selected by new_episode, and the stacked states
+        are returned instead.
+        """
+
+        stack = self.frame_stack
+        if stack is not None:
+            frames = stack.next_frame()
+        else:
+            frames = self.state_buffer if out is None else out
+
+        if self.state_rep == "pixel":
+            self._get_pixel_state(frames)
+        else:
+            self._get_coord_state(frames)
+
+        states = frames
+        if stack is not None:
+            stack.advance(new_episode)
+            states = stack.stacked()
+            if out is not None:
+                np.copyto(out, states)
+                return out
+
+        if out is None and self.copy_state:
+            return states.copy()
+        return states
+
+    def _get_pixel_state(self, states):
+        """
+        Writes the states of all games to states as rasterized pixel
+        arrays, with one pixel array per game.
+        """
+
+        ball_positions = np.stack((self.ball_x, self.ball_y), axis=-1).tolist()
+
+        for env in range(self.num_envs):
+            obstacle_rects = []
+            for n in range(self.size[env]):
+                slot = (self.head[env] + n) % MAX_OBSTACLE_SETS
+                top = self.obs_top[env, slot]
+                bottom = top + self.obs_height[env, slot]
+                for k in range(self.obs_count[env, slot]):
+                    obstacle_rects.append((self.obs_left[env, slot, k],
+                                           self.obs_right[env, slot, k],
+                                           top, bottom))
+
+            frame = self.rasterizer.draw_frame(ball_positions[env], obstacle_rects,
+                                               self.score[env])
+            self.pixel_format.write(frame, states[env])
+
+        return states
+
+    def _get_coord_state(self, coords):
+        """
+        Writes the states of all games to coords as arrays of coords, with
+        one row per game laid out as in DuetGame._get_coord_state().
+        """
+
+        top = self._oldest(self.obs_top)
+        bottom = top - self._oldest(self.obs_height)
+        left = self._oldest(self.obs_left)
+        right = self._oldest(self.obs_right)
+        double = self._oldest(self.obs_count) == 2
+
+        coords[:, 8:] = 0
+        coords[:, 0:4:2] = self.ball_x
+        coords[:, 1:4:2] = self.ball_y
+        coords[:, 4] = top
+        coords[:, 5] = bottom
+        coords[:, 6] = left[:, 0]
+        coords[:, 7] = right[:, 0]
+        coords[double, 8] = top[double]
+        coords[double, 9] = bottom[double]
+        coords[double, 10] = left[double, 1]
+        coords[double, 11] = right[double, 1]
+
+        return coords
@@ -0,0 +1,90 @@
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pytest
+
+from gym.envs.duet.duet_env import DuetGame
+from gym.envs.duet.duet_dataset import TrajectoryWriter, TrajectoryDataset, INITIAL_SHARD_ROWS
+
+
+def write_trajectories(directory, n_steps, shard_size, **kwargs):
+    """
+    Writes n_steps random steps of a seeded game to a dataset in
+    directory, and returns the writer and the transitions stepped.
+    """
+
+    game = DuetGame(headless=True)
+    game.man_init(**kwargs)
+    game.seed(3)
+    writer = TrajectoryWriter(game, directory, shard_size=shard_size)
+
+    rng = np.random.RandomState(0)
+    transitions = []
+    state = np.array(game.reset())
+    for _ in range(n_steps):
+        action = int(rng.randint(0, 3))
+        next_state, reward, game_over, _ = game.step(action)
+        next_state = np.array(next_state)
+        transitions.append((state, action, reward, next_state, game_over))
+        state = np.array(game.reset()) if game_over else next_state
+
+    return writer, transitions
+
+
+@pytest.mark.parametrize("n_steps, shard_size, kwargs", [
+    (1000, 150, {"state_rep": "coord"}),
+    (3000, INITIAL_SHARD_ROWS + 1000, {"state_rep": "coord", "frame_stack": 3, "n_repeat_action": 8}),
+    (1000, 150, {"state_rep": "pixel", "pixel_size": (32, 32), "frame_stack": 4}),
+    (1000, 150, {"state_rep": "pixel", "pixel_size": (32, 32), "frame_stack": 2,
+               "grayscale": True, "channels_first": True}),
+])
+def test_transitions_match_steps(tmp_path, n_steps, shard_size, kwargs):
+    """
+    The dataset gives back the transitions stepped, across shards, with
+    the frame stacks rebuilt, and the last shard is trimmed on close().
+    """
+
+    directory = str(tmp_path)
+    writer, transitions = write_trajectories(directory, n_steps, shard_size, **kwargs)
+    writer.close()
+
+    dataset = TrajectoryDataset(directory)
+    assert len(dataset) == n_steps
+    assert len(dataset.states) == -(-dataset.n_rows // shard_size) > 1
+    assert dataset.dones.sum() > 0
+
+    # Full shards grow past their initial capacity to shard_size rows
+    first = writer.shards[0]
+    array = np.load(os.path.join(directory, first["files"]["states"]), mmap_mode="r")
+    assert array.shape[0] == first["rows"] == shard_size
+
+    last = writer.shards[-1]
+    for name in last["files"]:
+        array = np.load(os.path.join(directory, last["files"][name]), mmap_mode="r")
+        assert array.shape[0] == last["rows"] < shard_size
+
+    batch = dataset.get_transitions(np.arange(n_steps))
+    for i, (state, action, reward, next_state, game_over) in enumerate(transitions):
+        assert np.array_equal(batch["states"][i], state)
+        assert np.array_equal(batch["next_states"][i], next_state)
+        assert batch["actions"][i] == action
+        assert batch["rewards"][i] == reward
+        assert batch["dones"][i] == game_over
+
+
+@pytest.mark.parametrize("frame_stack", [1, 3])
+def test_empty_dataset(tmp_path, frame_stack):
+
+    directory = str(tmp_path)
+    game = DuetGame(headless=True)
+    game.man_init(state_rep="coord", frame_stack=frame_stack)
+    TrajectoryWriter(game, directory).close()
+
+    dataset = TrajectoryDataset(directory)
+    assert len(dataset) == dataset.n_rows == 0
+
+    batch = dataset.get_transitions([])
+    assert batch["states"].shape == (0, 12*frame_stack)
+    assert len(batch["next_states"]) == len(batch["actions"]) == 0
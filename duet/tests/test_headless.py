@@ -0,0 +1,35 @@
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+
+from gym.envs.duet.duet_env import DuetGame
+
+
+def test_headless_game_keeps_other_windows():
+    """
+    Switching a game to headless leaves the display of the windowed games
+    in the same process usable.
+    """
+
+    windowed = DuetGame()
+    windowed.man_init()
+    windowed.seed(1)
+    windowed.reset()
+
+    headless = DuetGame()
+    headless.man_init(headless=True)
+    headless.seed(1)
+    headless.reset()
+
+    for _ in range(20):
+        windowed_state, _, _, _ = windowed.step(1)
+        windowed.render()
+        headless_state, _, _, _ = headless.step(1)
+        assert np.array_equal(windowed_state, headless_state)
+
+    # Rendering opens a window for the headless game as well
+    headless.render()
+    windowed.step(0)
+    windowed.render()
@@ -0,0 +1,55 @@
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pytest
+
+from gym.envs.duet.duet_env import DuetGame
+
+# Bounds on the difference, in 0-255 pixel values, between the numpy and
+# pygame pixel backends. They only differ at shape edges, where PIL filters
+# when resizing the screen, so large differences are rare.
+MAX_MEAN_DIFF = 1.0
+LARGE_DIFF = 64
+MAX_LARGE_DIFF_FRACTION = 1e-4
+
+
+def rollout(pixel_backend, n_steps, seed=0, **kwargs):
+    """
+    Returns the states of a seeded rollout of random actions with the
+    given pixel backend, resetting games that end.
+    """
+
+    game = DuetGame(headless=True)
+    game.man_init(state_rep="pixel", pixel_backend=pixel_backend, **kwargs)
+    game.seed(seed)
+
+    rng = np.random.RandomState(seed)
+    states = [game.reset()]
+    for _ in range(n_steps):
+        state, _, game_over, _ = game.step(rng.randint(0, 3))
+        states.append(state)
+        if game_over:
+            states.append(game.reset())
+
+    return np.stack(states)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"n_repeat_action": 4},
+    {"draw_rects": True},
+    {"pixel_size": (42, 60), "grayscale": True, "channels_first": True},
+])
+def test_numpy_backend_matches_pygame(kwargs):
+
+    numpy_states = rollout("numpy", 300, **kwargs)
+    pygame_states = rollout("pygame", 300, **kwargs)
+
+    assert numpy_states.shape == pygame_states.shape
+    assert numpy_states.dtype == pygame_states.dtype
+
+    diff = np.abs(numpy_states.astype(np.float64) - pygame_states)
+    assert diff.mean() < MAX_MEAN_DIFF
+    assert (diff > LARGE_DIFF).mean() < MAX_LARGE_DIFF_FRACTION
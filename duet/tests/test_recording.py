@@ -0,0 +1,67 @@
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pytest
+
+from gym.envs.duet.duet_env import DuetGame
+from gym.envs.duet.duet_recording import EpisodeRecorder, EpisodeReplayer
+
+N_EPISODES = 4
+
+
+def record_episodes(path, mode="ai", **kwargs):
+    """
+    Records N_EPISODES episodes of a seeded game to path, mixing step()
+    with step_until() calls of 0 or more frames in "ai" mode, and returns
+    the states of every episode and the final scores.
+    """
+
+    game = DuetGame(mode=mode, headless=True)
+    game.man_init(mode=mode, state_rep="coord", **kwargs)
+    game.seed(11, 3)
+    recorder = EpisodeRecorder(game)
+
+    rng = np.random.RandomState(0)
+    episodes = []
+    for _ in range(N_EPISODES):
+        states = [game.reset()]
+        game_over = False
+        while not game_over:
+            action = int(rng.choice([0, 0, 1, 2]))
+            draw = rng.rand()
+            if mode == "ai" and draw < 0.1:
+                state, _, game_over, _ = game.step_until(action, 0)
+            elif mode == "ai" and draw < 0.25:
+                state, _, game_over, _ = game.step_until(action, int(rng.choice([5, 40])))
+            else:
+                state, _, game_over, _ = game.step(action)
+            states.append(state)
+        episodes.append((np.stack(states), game.score))
+
+    recorder.save(path)
+
+    return episodes
+
+
+@pytest.mark.parametrize("mode, kwargs", [
+    ("ai", {}),
+    ("ai", {"n_repeat_action": 3}),
+    ("ai", {"frame_stack": 3}),
+    ("contr", {}),
+])
+def test_replay_matches_recording(tmp_path, mode, kwargs):
+
+    path = str(tmp_path / "episodes.npz")
+    episodes = record_episodes(path, mode, **kwargs)
+    replayer = EpisodeReplayer(path)
+
+    assert len(replayer) == N_EPISODES
+    for n, (states, score) in enumerate(episodes):
+        assert np.array_equal(replayer.states(n), states)
+        assert replayer.final_score(n) == score
+        assert replayer.verify(n)
+
+        for t in (0, 1, len(states)//2, len(states) - 1):
+            assert np.array_equal(replayer.state(n, t), states[t])
@@ -0,0 +1,87 @@
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import random
+
+import numpy as np
+import pytest
+
+from gym.envs.duet.duet_env import DuetGame, GAME_STATE_DTYPE
+from gym.envs.duet.duet_backend.obstacle_manager import ObstacleTape
+
+N_STEPS = 3000
+SNAPSHOT_INTERVAL = 50
+REPLAY_STEPS = 40
+
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"random_obstacles": False},
+    {"tape": ObstacleTape.generate(random.Random(4), 9)},
+    {"state_rep": "pixel", "pixel_backend": "numpy", "pixel_size": (42, 42)},
+    {"frame_stack": 4},
+    {"state_rep": "pixel", "pixel_backend": "numpy", "pixel_size": (42, 42),
+     "channels_first": True, "frame_stack": 3},
+])
+def test_snapshots_restore_in_reverse_order(kwargs):
+    """
+    Snapshots taken across several episodes, restored from the last to
+    the first, replay the same trajectory as the uninterrupted run.
+    """
+
+    kwargs.setdefault("state_rep", "coord")
+    game = DuetGame(headless=True)
+    game.man_init(**kwargs)
+    game.seed(2)
+    game.reset()
+
+    rng = np.random.RandomState(0)
+    actions = rng.randint(0, 3, size=N_STEPS)
+    snapshots = []
+    steps = []
+    for t, action in enumerate(actions):
+        if t % SNAPSHOT_INTERVAL == 0:
+            snapshots.append((t, game.get_state()))
+        steps.append(game.step(action)[:3])
+        if steps[-1][2]:
+            game.reset()
+
+    assert len(set(int(snapshot["episode"]) for _, snapshot in snapshots)) > 1
+
+    for t, snapshot in reversed(snapshots):
+        game.set_state(snapshot)
+        assert game.get_state().tobytes() == snapshot.tobytes()
+
+        for k in range(t, min(t + REPLAY_STEPS, N_STEPS)):
+            state, reward, game_over, _ = game.step(actions[k])
+            assert np.array_equal(state, steps[k][0])
+            assert (reward, game_over) == steps[k][1:]
+            if game_over:
+                break
+
+
+def test_snapshot_without_frames_refills_stack():
+    """
+    A GAME_STATE_DTYPE record holds no frames, and restoring it fills the
+    frame stack with the restored observation, as on reset.
+    """
+
+    game = DuetGame(headless=True)
+    game.man_init(state_rep="coord", frame_stack=4)
+    game.seed(2)
+    game.reset()
+    for _ in range(10):
+        game.step(1)
+
+    snapshot = game.get_state()
+    single = np.zeros((), dtype=GAME_STATE_DTYPE)
+    for name in GAME_STATE_DTYPE.names:
+        single[name] = snapshot[name]
+    observation = game.frame_stack.latest().copy()
+
+    for _ in range(10):
+        game.step(2)
+    game.set_state(single)
+
+    assert np.array_equal(game.frame_stack.stacked(), np.tile(observation, 4))
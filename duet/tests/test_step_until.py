@@ -0,0 +1,71 @@
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import random
+
+import numpy as np
+import pytest
+
+from gym.envs.duet.duet_env import DuetGame, NEW_OBS_INTERVAL
+
+N_CALLS = 300
+
+
+def make_game(**kwargs):
+    """
+    Returns a seeded headless game with coord states.
+    """
+    game = DuetGame(headless=True)
+    game.man_init(state_rep="coord", **kwargs)
+    game.seed(5)
+    return game
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"random_obstacles": False},
+    {"random_obstacles": True},
+    {"collision": "circle"},
+    {"collision": "circle", "random_obstacles": False},
+    {"collision_table": True},
+])
+def test_step_until_matches_steps(kwargs):
+    """
+    step_until() gives the same state, reward and game over as stepping
+    frame by frame for its number of frames, and no event happens before
+    its last frame.
+    """
+
+    rng = random.Random(1)
+    calls = [(rng.choice([0, 0, 0, 1, 2]), rng.choice([5, 40, 1000])) for _ in range(N_CALLS)]
+
+    game = make_game(**kwargs)
+    stepped = make_game(**kwargs)
+    game.reset()
+    stepped.reset()
+
+    n_game_overs = 0
+    for action, max_frames in calls:
+        state, reward, game_over, info = game.step_until(action, max_frames)
+        frames = info["frames"]
+        assert 1 <= frames <= max_frames
+
+        total_reward = 0
+        for frame in range(frames):
+            spawned = stepped.i % NEW_OBS_INTERVAL == 0
+            score = stepped.score
+            stepped_state, stepped_reward, stepped_game_over, _ = stepped.step(action)
+            total_reward += stepped_reward
+            if frame < frames - 1:
+                assert not (spawned or stepped_game_over or stepped.score != score)
+
+        assert np.array_equal(state, stepped_state)
+        assert reward == total_reward
+        assert game_over == stepped_game_over
+
+        if game_over:
+            n_game_overs += 1
+            game.reset()
+            stepped.reset()
+
+    assert n_game_overs > 0
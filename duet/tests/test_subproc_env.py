@@ -0,0 +1,93 @@
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pytest
+
+from gym.envs.duet.duet_env import DuetGame
+from gym.envs.duet.duet_subproc_env import DuetSubprocVecEnv
+
+NUM_ENVS = 3
+SEED = 5
+N_STEPS = 600
+
+
+def test_pool_matches_games():
+
+    pool = DuetSubprocVecEnv(NUM_ENVS, state_rep="coord")
+    try:
+        pool.seed(SEED)
+        games = []
+        for index in range(NUM_ENVS):
+            game = DuetGame(headless=True)
+            game.man_init(state_rep="coord")
+            game.seed(SEED, index)
+            games.append(game)
+
+        states = pool.reset()
+        for game, state in zip(games, states):
+            assert np.array_equal(game.reset(), state)
+
+        rng = np.random.RandomState(0)
+        n_game_overs = 0
+        for _ in range(N_STEPS):
+            actions = rng.randint(0, 3, size=NUM_ENVS)
+            states, rewards, game_overs = pool.step(actions)
+
+            for game, action, state, reward, game_over in zip(games, actions, states,
+                                                              rewards, game_overs):
+                game_state, game_reward, game_game_over, _ = game.step(action)
+                assert game_game_over == game_over
+                assert game_reward == reward
+                if game_over:
+                    game_state = game.reset()
+                assert np.array_equal(game_state, state)
+
+            n_game_overs += game_overs.sum()
+
+        assert n_game_overs > 0
+    finally:
+        pool.close()
+
+
+def test_states_are_kept_during_next_step():
+    """
+    With copy_state=False, the states returned by a step are not
+    overwritten by the next step.
+    """
+
+    pool = DuetSubprocVecEnv(NUM_ENVS, state_rep="coord", copy_state=False)
+    try:
+        pool.seed(SEED)
+        states = pool.reset()
+        rng = np.random.RandomState(0)
+        for _ in range(50):
+            kept = states.copy()
+            pool.step_async(rng.randint(0, 3, size=NUM_ENVS))
+            assert np.array_equal(states, kept)
+            new_states, _, _ = pool.step_wait()
+            assert np.array_equal(states, kept)
+            assert not np.shares_memory(states, new_states)
+            states = new_states
+    finally:
+        pool.close()
+
+
+def test_worker_failure_is_reported():
+
+    with pytest.raises(RuntimeError) as error:
+        DuetSubprocVecEnv(2, state_rep="coord", pixel_backend="invalid")
+    assert "Traceback" in str(error.value)
+    assert "Invalid pixel backend 'invalid'" in str(error.value)
+
+    pool = DuetSubprocVecEnv(2, state_rep="coord")
+    try:
+        pool.reset()
+        for remote in pool.remotes:
+            remote.send(("invalid", None))
+        with pytest.raises(RuntimeError) as error:
+            pool.step_wait()
+        assert "Invalid command 'invalid'" in str(error.value)
+    finally:
+        pool.close()
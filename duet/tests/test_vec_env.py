@@ -0,0 +1,78 @@
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import random
+
+import numpy as np
+import pytest
+
+from gym.envs.duet.duet_env import DuetGame
+from gym.envs.duet.duet_vec_env import DuetVecEnv
+from gym.envs.duet.duet_backend.obstacle_manager import ObstacleTape
+
+NUM_ENVS = 4
+SEED = 3
+N_STEPS = 1500
+
+
+def make_games(num_envs, seed, **kwargs):
+    """
+    Returns num_envs headless games initialized with kwargs and seeded
+    like the games of a DuetVecEnv.
+    """
+
+    games = []
+    for index in range(num_envs):
+        game = DuetGame(headless=True)
+        game.man_init(**kwargs)
+        game.seed(seed, index)
+        games.append(game)
+
+    return games
+
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"random_obstacles": False},
+    {"n_repeat_action": 4},
+    {"collision": "circle"},
+    {"collision_table": True},
+    {"tape": ObstacleTape.generate(random.Random(4), 9)},
+    {"state_rep": "pixel", "pixel_size": (42, 42)},
+    {"frame_stack": 3},
+    {"state_rep": "pixel", "pixel_size": (42, 42), "grayscale": True,
+     "channels_first": True, "frame_stack": 2},
+])
+def test_vec_env_matches_games(kwargs):
+
+    vec_env = DuetVecEnv(NUM_ENVS, **kwargs)
+    vec_env.seed(SEED)
+
+    game_kwargs = dict(kwargs, state_rep=kwargs.get("state_rep", "coord"))
+    if game_kwargs["state_rep"] == "pixel":
+        game_kwargs["pixel_backend"] = "numpy"
+    games = make_games(NUM_ENVS, SEED, **game_kwargs)
+
+    states = vec_env.reset()
+    for game, state in zip(games, states):
+        assert np.array_equal(game.reset(), state)
+
+    rng = np.random.RandomState(0)
+    n_game_overs = 0
+    for _ in range(N_STEPS):
+        actions = rng.randint(0, 3, size=NUM_ENVS)
+        states, rewards, game_overs = vec_env.step(actions)
+
+        for game, action, state, reward, game_over in zip(games, actions, states,
+                                                          rewards, game_overs):
+            game_state, game_reward, game_game_over, _ = game.step(action)
+            assert game_game_over == game_over
+            assert game_reward == reward
+            if game_over:
+                game_state = game.reset()
+            assert np.array_equal(game_state, state)
+
+        n_game_overs += game_overs.sum()
+
+    assert n_game_overs > 0